@@ -1 +1,4 @@
 from .db import BoltDB # noqa
+from .compact import compact # noqa
+from .join import merge, intersect, anti_join # noqa
+from .codec import register_codec # noqa
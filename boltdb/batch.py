@@ -0,0 +1,63 @@
+import threading
+
+
+class Call:
+
+    def __init__(self, fn):
+        self.fn = fn
+        self.err = None
+        self.solo = False
+        self.done = threading.Event()
+
+
+class Batch:
+    """functions from concurrent db.batch() callers sharing one write tx"""
+
+    def __init__(self, db):
+        self.db = db
+        self.calls = []
+        self.started = False
+        self.start_lock = threading.Lock()
+        self.timer = threading.Timer(db.max_batch_delay, self.trigger)
+        self.timer.daemon = True
+        self.timer.start()
+
+    def trigger(self):
+        with self.start_lock:
+            if self.started:
+                return
+            self.started = True
+        self.run()
+
+    def run(self):
+        db = self.db
+        with db.batch_lock:
+            self.timer.cancel()
+            if db.pending_batch is self:
+                db.pending_batch = None
+
+        calls = self.calls
+        while calls:
+            failed = None
+            try:
+                with db.update() as tx:
+                    for i, c in enumerate(calls):
+                        failed = i
+                        c.fn(tx)
+                    failed = None
+            except Exception as e:
+                if failed is None:
+                    # commit itself failed, every caller gets the error
+                    for c in calls:
+                        c.err = e
+                        c.done.set()
+                    return
+                # let the failing function retry on its own, outside the batch
+                c = calls.pop(failed)
+                c.solo = True
+                c.done.set()
+                continue
+
+            for c in calls:
+                c.done.set()
+            return
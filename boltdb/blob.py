@@ -0,0 +1,119 @@
+import io
+
+from .share import page_struct
+
+
+# pages staged at a time when the size of a stream isn't known up front
+STAGE_PAGES = 16
+# most bytes asked of a stream in one read
+READ_CHUNK = 1 << 20
+
+
+class BlobReader(io.RawIOBase):
+    """a read-only file over a value, reads copy straight out of the mmap
+
+    Only valid while the tx it was opened in is open.
+    """
+
+    def __init__(self, data):
+        super().__init__()
+        self.data = memoryview(data)
+        self.pos = 0
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def readinto(self, b):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        b = memoryview(b).cast("B")
+        end = min(self.pos + len(b), len(self.data))
+        n = max(end - self.pos, 0)
+        b[:n] = self.data[self.pos:self.pos+n]
+        self.pos += n
+        return n
+
+    def read(self, size=-1):
+        if self.closed:
+            raise ValueError("I/O operation on closed file")
+        end = len(self.data)
+        if size is not None and size >= 0:
+            end = min(self.pos + size, end)
+        data = bytes(self.data[self.pos:end])
+        self.pos += len(data)
+        return data
+
+    def readall(self):
+        return self.read()
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            pos = offset
+        elif whence == io.SEEK_CUR:
+            pos = self.pos + offset
+        elif whence == io.SEEK_END:
+            pos = len(self.data) + offset
+        else:
+            raise ValueError("invalid whence")
+        if pos < 0:
+            raise ValueError("negative seek position")
+        self.pos = pos
+        return pos
+
+    def tell(self):
+        return self.pos
+
+    def getbuffer(self):
+        # the whole value, without a copy
+        return self.data
+
+    def close(self):
+        if not self.closed:
+            self.data.release()
+        super().close()
+
+
+def stage(tx, fileobj, size=None):
+    """copy fileobj into freshly allocated pages, one chunk at a time
+
+    Returns a memoryview over the copy. The pages stay on tx.staged and
+    are freed at commit, once the value has been written to its leaf.
+    """
+    pagesize = tx.db.pagesize
+    if size is not None:
+        npages = (size + page_struct.size + pagesize - 1) // pagesize
+    else:
+        npages = STAGE_PAGES
+    p = tx.db.allocate(npages)
+    # on the list right away, so the pages are freed even if the read fails
+    tx.staged.append(p)
+    used = 0
+    while size is None or used < size:
+        room = npages * pagesize - page_struct.size - used
+        if room == 0:
+            # out of room for a stream of unknown size, move to a run twice as big
+            q = tx.db.allocate(npages * 2)
+            q.data[:used] = p.data[:used]
+            tx.db.freelist.free(tx.txid, p)
+            tx.staged[-1] = q
+            p, npages = q, npages * 2
+            continue
+        room = min(room, READ_CHUNK)
+        if size is not None:
+            room = min(room, size - used)
+        readinto = getattr(fileobj, "readinto", None)
+        if readinto is not None:
+            n = readinto(p.data[used:used+room])
+        else:
+            chunk = fileobj.read(room)
+            n = len(chunk)
+            p.data[used:used+n] = chunk
+        if not n:
+            if size is not None:
+                raise Exception("unexpected end of stream")
+            break
+        used += n
+    return p.data[:used]
@@ -1,7 +1,14 @@
-from .cursor import Cursor
+from bisect import bisect_left
+from operator import itemgetter
+
+from .blob import BlobReader, stage
+from .bulk import BulkLoader
+from .codec import CODEC_NONE, DEFAULT_THRESHOLD, codec_id, get_codec
+from .cursor import Cursor, ElemRef
 from .page import page_from_data
-from .node import Node
-from .share import bucket_tuple, bucket_struct, bucketLeafFlag
+from .node import Node, DEFAULT_FILL_PERCENT
+from .share import bucket_tuple, bucket_struct, bucketLeafFlag, \
+    codec_tuple, codec_struct, bucketCodecFlag, compressedValueFlag
 
 
 class Bucket:
@@ -19,26 +26,209 @@ class Bucket:
 
         self.sub_buckets = {}
 
+        # how full split leaves are left, not persisted, like bolt
+        self.fill_percent = DEFAULT_FILL_PERCENT
+
+        # values of at least threshold bytes are compressed with codec
+        self.codec = CODEC_NONE
+        self.threshold = DEFAULT_THRESHOLD
+
+        # set by bulk_load, its new root has no node to carry the header
+        # to spill
+        self.loaded = False
+
     def cursor(self):
         return Cursor(self)
 
     def __iter__(self):
         return self.cursor()
 
-    def get(self, key):
-        k, v = self.cursor().seek(key)
-        if k != key:
+    def __reversed__(self):
+        return self.reversed()
+
+    def reversed(self, start=None):
+        """iterate (key, value) pairs backwards from start, or the last key"""
+        return self.cursor().iter_reverse(start)
+
+    def range(self, start=None, end=None, prefix=None, keys_only=False,
+              limit=None):
+        """iterate (key, value) pairs, or keys, in [start, end) or by prefix"""
+        return self.cursor().iter_range(start, end, prefix, keys_only, limit)
+
+    def get(self, key, copy=True):
+        # with copy=False, values read from a page are memoryviews of the mmap
+        k, v, flags = self.cursor()._seek(key, copy)
+        if k != key or flags & bucketLeafFlag:
             return None
+        if flags & compressedValueFlag:
+            return self.decompress(v)
         return v
 
+    def open_blob(self, key):
+        """a read-only file over the value of key, None if there is none
+
+        Pages are read straight from the mmap rather than through the page
+        cache, so nothing is copied until read. Only valid while the tx is.
+        """
+        pgid = self.root_pgid
+        while True:
+            if self.root_pgid == 0 or pgid in self.nodes:
+                p, n = self.page_node(pgid)
+            else:
+                p, n = self.tx.raw_page(pgid), None
+            ref = ElemRef(p, n, 0)
+            ref.index = ref.search(key)
+            if ref.is_leaf():
+                break
+            pgid = ref.child_pgid()
+        if ref.index >= ref.count():
+            return None
+        k, v, flags = ref.elem(ref.index, copy=False)
+        if k != key or flags & bucketLeafFlag:
+            return None
+        if flags & compressedValueFlag:
+            v = self.decompress(v)
+        return BlobReader(v)
+
+    def put_stream(self, key, fileobj, size=None):
+        """put a value read from fileobj in chunks
+
+        The stream is staged in free pages of the db file instead of memory,
+        and copied into its leaf at commit. It's never compressed.
+        """
+        if not self.tx.writable:
+            raise Exception("cannot write in readonly tx")
+        self._put(key, stage(self.tx, fileobj, size), 0)
+
+    def get_many(self, keys, copy=True):
+        """values for keys, in the same order, None where missing
+
+        The keys are sorted and looked up in one walk down the tree, each
+        subtree is visited once for all the keys it holds.
+        """
+        found = {}
+        wanted = sorted(set(keys))
+        if wanted:
+            self._get_many(self.root_pgid, wanted, 0, len(wanted), found, copy)
+        return [found.get(k) for k in keys]
+
+    def _get_many(self, pgid, keys, lo, hi, found, copy):
+        p, n = self.page_node(pgid)
+        ref = ElemRef(p, n, 0)
+        count = ref.count()
+        if ref.is_leaf():
+            index = 0
+            for key in keys[lo:hi]:
+                index = ref.search(key, index)
+                if index == count:
+                    break
+                k, v, flags = ref.elem(index, copy)
+                if k == key and not flags & bucketLeafFlag:
+                    if flags & compressedValueFlag:
+                        v = self.decompress(v)
+                    found[key] = v
+            return
+
+        while lo < hi:
+            ref.index = ref.search(keys[lo])
+            end = hi
+            if ref.index + 1 < count:
+                end = bisect_left(keys, ref.key_at(ref.index+1), lo, hi)
+            self._get_many(ref.child_pgid(), keys, lo, end, found, copy)
+            lo = end
+
+    def put_many(self, items):
+        """put (key, value) pairs, sorted first so each node is reached once"""
+        if not self.tx.writable:
+            raise Exception("cannot write in readonly tx")
+        items = sorted(items, key=itemgetter(0))
+        if not items:
+            return
+        keys = [k for k, _ in items]
+        root = self.root_node
+        if root is None:
+            root = self.node(self.root_pgid, None)
+        self._put_many(root, keys, items, 0, len(items))
+
+    def _put_many(self, n, keys, items, lo, hi):
+        if n.is_leaf:
+            for key, value in items[lo:hi]:
+                index = bisect_left(n.keys, key)
+                if index < len(n.keys) and n.keys[index] == key and \
+                        n.inodes[index].flags & bucketLeafFlag:
+                    raise Exception("cannot write sub bucket")
+                value, flags = self.compress(value)
+                n.put(key, key, value, 0, flags)
+            return
+
+        while lo < hi:
+            index = bisect_left(n.keys, keys[lo])
+            if index == len(n.keys) or (index > 0 and n.keys[index] != keys[lo]):
+                index -= 1
+            end = hi
+            if index + 1 < len(n.keys):
+                end = bisect_left(keys, n.keys[index+1], lo, hi)
+            self._put_many(n.child_at(index), keys, items, lo, end)
+            lo = end
+
     def put(self, key, value):
         if not self.tx.writable:
             raise Exception("cannot write in readonly tx")
+        value, flags = self.compress(value)
+        self._put(key, value, flags)
+
+    def _put(self, key, value, flags):
         c = self.cursor()
-        k, v = c.seek(key)
-        if k == key and v is None:
+        k, _, old_flags = c._seek(key)
+        if k == key and old_flags & bucketLeafFlag:
             raise Exception("cannot write sub bucket")
-        c.node().put(key, key, value, 0, 0)
+        c.node().put(key, key, value, 0, flags)
+
+    def compress(self, value):
+        """the value as stored and its flags, compressed if that saves space"""
+        if self.codec == CODEC_NONE or len(value) < self.threshold:
+            return value, 0
+        data = get_codec(self.codec)[0](value)
+        if len(data) >= len(value):
+            return value, 0
+        return data, compressedValueFlag
+
+    def decompress(self, value):
+        return get_codec(self.codec)[1](value)
+
+    def bulk_load(self, items):
+        """load sorted (key, value) pairs, building the tree bottom-up
+
+        Only an empty bucket is built directly, otherwise this falls back to
+        put(). Raises if the keys aren't strictly increasing.
+        """
+        if not self.tx.writable:
+            raise Exception("cannot write in readonly tx")
+        items = iter(items)
+        if self.cursor().first()[0] is not None:
+            for k, v in items:
+                self.put(k, v)
+            return
+
+        loader = BulkLoader(self.tx)
+        try:
+            for k, v in items:
+                v, flags = self.compress(v)
+                loader.add(k, v, flags)
+            if loader.last_key is None:
+                return
+            root = loader.finish()
+        except: # noqa
+            loader.abort()
+            raise
+
+        self.free()
+        self.nodes = {}
+        self.pages = {}
+        self.root_node = None
+        self.page = None
+        self.root_pgid = root
+        self.loaded = True
 
     def delete(self, key):
         if not self.tx.writable:
@@ -58,20 +248,35 @@ class Bucket:
         k, v, flags = c._seek(name)
         if k != name or flags & bucketLeafFlag == 0:
             return None
-        b = self._open_bucket(v)
+        b = self._open_bucket(v, flags)
         b.name = name
         self.sub_buckets[name] = b
         return b
 
-    def _open_bucket(self, value):
+    def _open_bucket(self, value, flags):
         bsize = bucket_struct.size
         b = bucket_tuple._make(bucket_struct.unpack(value[:bsize]))
         b = Bucket(self.tx, b.root)
+        if flags & bucketCodecFlag:
+            codec = codec_tuple._make(codec_struct.unpack(value[bsize:bsize+codec_struct.size]))
+            b.codec, b.threshold = codec.codec, codec.threshold
+            bsize += codec_struct.size
         if b.root_pgid == 0:
             b.page = page_from_data(value[bsize:])
         return b
 
-    def create_bucket(self, name):
+    def header(self):
+        """the header value and flags of this bucket in its parent, without
+        the page of an inline bucket"""
+        value = bucket_struct.pack(self.root_pgid, 0)
+        if self.codec == CODEC_NONE:
+            return value, bucketLeafFlag
+        value += codec_struct.pack(self.codec, self.threshold)
+        return value, bucketLeafFlag | bucketCodecFlag
+
+    def create_bucket(self, name, codec=None, threshold=DEFAULT_THRESHOLD):
+        """create a sub bucket, values of at least threshold bytes put in it
+        are compressed with codec, a registered codec id or name"""
         if not self.tx.writable:
             raise Exception("cannot write in readonly tx")
         c = self.cursor()
@@ -82,11 +287,13 @@ class Bucket:
             raise Exception("incompatible value")
 
         b = Bucket(self.tx, 0)
+        b.codec = codec_id(codec)
+        b.threshold = threshold
         b.root_node = Node(self)
         b.root_node.is_leaf = True
-        value = b.inline_value()
+        value, flags = b.inline_value()
 
-        c.node().put(name, name, value, 0, bucketLeafFlag)
+        c.node().put(name, name, value, 0, flags)
         self.page = None
         return self.bucket(name)
 
@@ -98,14 +305,19 @@ class Bucket:
         if child is None:
             raise Exception("bucket not exists")
 
+        for k in child.sub_bucket_names():
+            child.delete_bucket(k)
+
         del self.sub_buckets[name]
 
+        child.free()
+        child.nodes = {}
+        child.root_node = None
+
         c = self.cursor()
         c._seek(name)
         c.node().delete(name)
 
-        # TODO free pages
-
     def page_node(self, pgid):
         if self.root_pgid == 0:
             if self.root_node is not None:
@@ -143,32 +355,33 @@ class Bucket:
         if n is None or not n.is_leaf:
             return False
         # size = page_struct.size
-        size = 16
+        size = 16 + 8 * len(n.inodes) + n.payload
+        if size > 1024:
+            return False
         for i in n.inodes:
-            size += 8 + len(i.key) + len(i.value)
-            if i.flags * bucketLeafFlag:
-                return False
-            if size > 1024:
+            if i.flags & bucketLeafFlag:
                 return False
         return True
 
     def inline_value(self):
         n = self.root_node
-        value = memoryview(bytearray(bucket_struct.size+n.size()))
-        bucket_struct.pack_into(value, 0, 0, 0)
-        p = page_from_data(value[bucket_struct.size:])
+        header, flags = self.header()
+        value = memoryview(bytearray(len(header)+n.size()))
+        value[:len(header)] = header
+        p = page_from_data(value[len(header):])
         n.write(p)
-        return value.obj
+        return value.obj, flags
 
     def spill(self):
         for name, child in self.sub_buckets.items():
             if child.inlineable():
-                value = child.inline_value()
+                child.free()
+                value, header_flags = child.inline_value()
             else:
                 child.spill()
-                value = bucket_struct.pack(child.root_pgid, 0)
+                value, header_flags = child.header()
 
-            if child.root_node is None:
+            if child.root_node is None and not child.loaded:
                 continue
 
             c = self.cursor()
@@ -177,7 +390,7 @@ class Bucket:
                 raise Exception("misplaced bucket header")
             if flags & bucketLeafFlag == 0:
                 raise Exception("unexpected bucket header flag")
-            c.node().put(name, name, value, 0, bucketLeafFlag)
+            c.node().put(name, name, value, 0, header_flags)
 
         if self.root_node is None:
             return
@@ -186,6 +399,49 @@ class Bucket:
         self.root_node = self.root_node.root()
         self.root_pgid = self.root_node.pgid
 
+    def for_each_page_node(self, pgid):
+        # materialized nodes take the place of their pages, other pages
+        # are read raw since a walk needs little more than their headers
+        if self.root_pgid == 0 or pgid in self.nodes:
+            p, n = self.page_node(pgid)
+        else:
+            p, n = self.tx.raw_page(pgid), None
+        yield p, n
+        if n is not None:
+            if not n.is_leaf:
+                for i in n.inodes:
+                    yield from self.for_each_page_node(i.pgid)
+        elif p.is_branch():
+            for i in range(p.count):
+                yield from self.for_each_page_node(p.branch_pgid(i))
+
+    def sub_bucket_names(self):
+        names = []
+        for p, n in self.for_each_page_node(self.root_pgid):
+            if n is not None:
+                if n.is_leaf:
+                    names.extend(i.key for i in n.inodes if i.flags & bucketLeafFlag)
+            elif p.is_leaf():
+                for i in range(p.count):
+                    k, _, flags = p.leaf_elem(i, copy=False)
+                    if flags & bucketLeafFlag:
+                        names.append(bytes(k))
+        return names
+
+    def free(self):
+        # release every page of the bucket, e.g. before it turns inline
+        if self.root_pgid == 0:
+            return
+        tx = self.tx
+        pages = []
+        for p, n in list(self.for_each_page_node(self.root_pgid)):
+            if n is not None:
+                n.free()
+            else:
+                pages.append(p)
+        tx.db.freelist.free_pages(tx.txid, pages)
+        self.root_pgid = 0
+
     def rebalance(self):
         for n in list(self.nodes.values()):
             n.rebalance()
@@ -0,0 +1,113 @@
+from .node import Inode
+from .share import page_struct, leaf_elem_struct, branch_elem_struct, \
+    leafPageFlag, branchPageFlag
+
+
+# single pages are allocated this many at a time
+LEAF_RUN = 64
+
+
+class BulkLoader:
+    """build a B+tree bottom-up from sorted key/values
+
+    Leaves are packed full and written as soon as they are, each full page
+    pushes its first key one level up, so only one pending page per level
+    is held in memory.
+    """
+
+    def __init__(self, tx):
+        self.tx = tx
+        self.pagesize = tx.db.pagesize
+        self.levels = []  # per level: [inodes, size]
+        self.run = []     # allocated leaf pages not yet written
+        self.written = []
+        self.last_key = None
+
+    def add(self, key, value, flags=0):
+        if self.last_key is not None and key <= self.last_key:
+            raise Exception("bulk load keys must be sorted")
+        self.last_key = key
+        self._add(0, Inode(key, value, 0, flags))
+
+    def finish(self):
+        """write the pending pages of every level, return the root pgid"""
+        level = 0
+        while True:
+            inodes, size = self.levels[level]
+            top = level == len(self.levels) - 1
+            if top and level > 0 and len(inodes) == 1:
+                pgid = inodes[0].pgid
+                break
+            pgid = self._write(level, inodes, size)
+            if top:
+                break
+            self._add(level+1, Inode(inodes[0].key, b"", pgid, 0))
+            level += 1
+        self._free_run()
+        return pgid
+
+    def abort(self):
+        self._free(self.written + self.run)
+        self.written = []
+        self.run = []
+
+    def _add(self, level, inode):
+        if level == len(self.levels):
+            self.levels.append([[], page_struct.size])
+        pending = self.levels[level]
+        elsz = leaf_elem_struct.size if level == 0 else branch_elem_struct.size
+        sz = elsz + len(inode.key) + len(inode.value)
+        if pending[0] and pending[1] + sz > self.pagesize:
+            inodes, size = pending
+            pending[0], pending[1] = [], page_struct.size
+            pgid = self._write(level, inodes, size)
+            self._add(level+1, Inode(inodes[0].key, b"", pgid, 0))
+        pending[0].append(inode)
+        pending[1] += sz
+
+    def _write(self, level, inodes, size):
+        n = (size + self.pagesize - 1) // self.pagesize
+        if n == 1:
+            # branches too, so nothing lands after the run but overflow pages
+            p = self._leaf_page()
+        else:
+            p = self.tx.allocate(n)
+        p.flags = leafPageFlag if level == 0 else branchPageFlag
+        p.write_inodes(inodes)
+        # the page lives in the mmap now, don't pin the decoded copy
+        p.inodes = p.keys = None
+        self.written.append(p)
+        return p.id
+
+    def _leaf_page(self):
+        if not self.run:
+            tx = self.tx
+            first = tx.allocate(LEAF_RUN)
+            del tx.pages[first.id]
+            for i in range(LEAF_RUN):
+                p = tx.db.page(first.id+i)
+                p.id = first.id + i
+                p.overflow = 0
+                tx.pages[p.id] = p
+                self.run.append(p)
+            self.run.reverse()
+        return self.run.pop()
+
+    def _free_run(self):
+        # the unused rest of a run at the end of the file goes back to it
+        # rather than leaving a hole, as when compacting into a new file
+        run, self.run = self.run, []
+        if not run:
+            return
+        tx = self.tx
+        if tx.db.release_tail(run[-1].id, len(run)):
+            for p in run:
+                del tx.pages[p.id]
+            return
+        self._free(run)
+
+    def _free(self, pages):
+        tx = self.tx
+        for p in pages:
+            tx.pages.pop(p.id, None)
+        tx.db.freelist.free_pages(tx.txid, pages)
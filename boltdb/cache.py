@@ -0,0 +1,59 @@
+import threading
+from collections import OrderedDict
+
+
+class PageCache:
+    """LRU of decoded pages shared by all transactions of a db.
+
+    A page id only gets new content after a writer allocates it, so the
+    writer drops the entry at allocation time and readers never see a
+    stale decode.
+    """
+
+    def __init__(self, max_pages=1024, max_bytes=None):
+        self.max_pages = max_pages
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.entries)
+
+    def get(self, pgid):
+        with self.lock:
+            entry = self.entries.get(pgid)
+            if entry is None:
+                return None
+            self.entries.move_to_end(pgid)
+            return entry[0]
+
+    def put(self, page, size):
+        with self.lock:
+            old = self.entries.pop(page.id, None)
+            if old is not None:
+                self.nbytes -= old[1]
+            self.entries[page.id] = (page, size)
+            self.nbytes += size
+            self.evict()
+
+    def over(self):
+        if len(self.entries) > self.max_pages:
+            return True
+        return self.max_bytes is not None and self.nbytes > self.max_bytes
+
+    def evict(self):
+        while self.entries and self.over():
+            _, (_, size) = self.entries.popitem(last=False)
+            self.nbytes -= size
+
+    def discard(self, pgid):
+        with self.lock:
+            old = self.entries.pop(pgid, None)
+            if old is not None:
+                self.nbytes -= old[1]
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.nbytes = 0
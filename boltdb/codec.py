@@ -0,0 +1,51 @@
+import lzma
+import zlib
+
+
+CODEC_NONE = 0
+CODEC_ZLIB = 1
+CODEC_LZMA = 2
+
+# values shorter than this are stored as they are
+DEFAULT_THRESHOLD = 64
+
+# codec id -> (compress, decompress), the id is what's stored in bucket headers
+codecs = {
+    CODEC_ZLIB: (zlib.compress, zlib.decompress),
+    CODEC_LZMA: (lzma.compress, lzma.decompress),
+}
+names = {
+    "zlib": CODEC_ZLIB,
+    "lzma": CODEC_LZMA,
+}
+
+
+def register_codec(codec_id, name, compress, decompress):
+    """make a codec usable by create_bucket(codec=...)
+
+    The id ends up on disk, so it must stay the same for the life of the db.
+    """
+    if codec_id <= CODEC_NONE or codec_id in codecs or name in names:
+        raise Exception("codec already registered")
+    codecs[codec_id] = (compress, decompress)
+    names[name] = codec_id
+
+
+def codec_id(codec):
+    # a codec id or a registered name
+    if codec is None:
+        return CODEC_NONE
+    if isinstance(codec, str):
+        if codec not in names:
+            raise Exception("unknown codec %s" % codec)
+        return names[codec]
+    if codec != CODEC_NONE and codec not in codecs:
+        raise Exception("unknown codec %d" % codec)
+    return codec
+
+
+def get_codec(codec_id):
+    c = codecs.get(codec_id)
+    if c is None:
+        raise Exception("unknown codec %d" % codec_id)
+    return c
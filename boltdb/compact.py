@@ -0,0 +1,79 @@
+import os
+
+from .db import BoltDB
+
+
+def buckets(bucket, path=()):
+    """yield (path, bucket) for bucket and every bucket below it"""
+    yield path, bucket
+    for k, v in bucket.cursor().iter_range():
+        if v is None:
+            yield from buckets(bucket.bucket(k), path + (k,))
+
+
+def compact(src, dst, tx_max_size=65536):
+    """copy every bucket of the db file src into a new, densely packed dst
+
+    Each bucket is bulk loaded from its sorted keys, and dst is committed
+    after every bucket once tx_max_size bytes of keys and values are
+    pending. dst must not exist or be empty. Returns the file sizes of src
+    and dst.
+    """
+    if os.path.exists(dst) and os.path.getsize(dst) > 0:
+        raise Exception("compact destination already exists")
+    src_db = BoltDB(src, readonly=True)
+    dst_db = BoltDB(dst)
+    try:
+        with src_db.view() as src_tx:
+            copy(src_tx, dst_db, tx_max_size)
+        size = dst_db.meta().max_pgid * dst_db.pagesize
+    finally:
+        src_db.close()
+        dst_db.close()
+
+    # the mmap grows ahead of the data, give the slack back
+    with open(dst, "r+b") as f:
+        f.truncate(size)
+    return os.path.getsize(src), os.path.getsize(dst)
+
+
+def copy(src_tx, dst_db, tx_max_size):
+    tx = dst_db.begin(True)
+    size = 0
+    try:
+        for path, src in buckets(src_tx.root):
+            b = tx.root
+            for name in path:
+                b = b.bucket(name)
+
+            sub = []
+
+            def items():
+                nonlocal size
+                # buckets come out of the same sorted stream, created below
+                for k, v in src.cursor().iter_range():
+                    if v is None:
+                        sub.append(k)
+                        continue
+                    size += len(k) + len(v)
+                    yield k, v
+
+            if src.root_pgid == 0:
+                # an inline bucket fits inline again, a loaded page would
+                # only be freed when spill inlines it
+                for k, v in items():
+                    b.put(k, v)
+            else:
+                b.bulk_load(items())
+            for k in sub:
+                child = src.bucket(k)
+                b.create_bucket(k, child.codec, child.threshold)
+
+            if size > tx_max_size:
+                tx.commit()
+                tx = dst_db.begin(True)
+                size = 0
+        tx.commit()
+    except: # noqa
+        tx.rollback()
+        raise
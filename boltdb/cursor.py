@@ -1,7 +1,10 @@
 from bisect import bisect_left
 
+from .share import compressedValueFlag
+
 
 class ElemRef:
+    __slots__ = ("page", "node", "index")
 
     def __init__(self, page, node, index):
         self.page = page
@@ -18,8 +21,48 @@ class ElemRef:
             return len(self.node.inodes)
         return self.page.count
 
+    def key_at(self, index):
+        if self.node is not None:
+            return self.node.keys[index]
+        return self.page.elem_key(index)
+
+    def child_pgid(self):
+        if self.node is not None:
+            return self.node.inodes[self.index].pgid
+        return self.page.branch_pgid(self.index)
+
+    def search(self, key, lo=0):
+        # first index with a key >= key, on a branch the child that holds key
+        if self.node is not None:
+            index = bisect_left(self.node.keys, key, lo)
+        else:
+            index = self.page.search(key, lo)
+        if self.is_leaf():
+            return index
+        if index == self.count() or (index > 0 and self.key_at(index) != key):
+            index -= 1
+        return index
+
+    def covers(self, key):
+        # a search for key from here lands where one from the root would
+        n = self.count()
+        if n == 0:
+            return False
+        return self.key_at(0) <= key <= self.key_at(n-1)
+
+    def elem(self, index, copy=True):
+        if self.node is not None:
+            n = self.node.inodes[index]
+            if copy and type(n.value) is memoryview:
+                # a streamed value, still staged in the mmap
+                return n.key, bytes(n.value), n.flags
+            return n.key, n.value, n.flags
+        return self.page.leaf_elem(index, copy)
+
 
 class Cursor:
+    __slots__ = ("bucket", "stack")
+
     def __init__(self, bucket):
         self.bucket = bucket
         self.stack = []
@@ -30,9 +73,10 @@ class Cursor:
         self.stack.append(ElemRef(p, n, 0))
         self._first()
         k, v, flags = self.key_value()
-        if flags & 0x1:
-            return k, None
-        return k, v
+        if k is None and self.stack[-1].count() == 0:
+            # an emptied leaf not yet rebalanced away
+            k, v, flags = self._next()
+        return self._pair(k, v, flags)
 
     def last(self):
         self.stack = []
@@ -42,15 +86,13 @@ class Cursor:
         self.stack.append(ref)
         self._last()
         k, v, flags = self.key_value()
-        if flags & 0x1:
-            return k, None
-        return k, v
+        if k is None and self.stack[-1].count() == 0:
+            # an emptied leaf not yet rebalanced away
+            k, v, flags = self._prev()
+        return self._pair(k, v, flags)
 
     def next(self):
-        k, v, flags = self._next()
-        if flags & 0x1:
-            return k, None
-        return k, v
+        return self._pair(*self._next())
 
     def __next__(self):
         if len(self.stack) == 0:
@@ -62,7 +104,62 @@ class Cursor:
         return k, v
 
     def prev(self):
-        pass
+        return self._pair(*self._prev())
+
+    def iter_reverse(self, start=None):
+        """yield (key, value) pairs from start, or the last key, backwards"""
+        if start is None:
+            k, v = self.last()
+        else:
+            k, v = self.seek_le(start)
+        while k is not None:
+            yield k, v
+            k, v = self.prev()
+
+    def iter_range(self, start=None, end=None, prefix=None, keys_only=False,
+                   limit=None):
+        """yield (key, value) pairs, or only keys, from start up to end
+
+        end is exclusive. With a prefix the scan starts at the prefix and
+        stops at the first key without it. Values are not read at all
+        with keys_only.
+        """
+        if prefix is not None and (start is None or start < prefix):
+            start = prefix
+        self.stack = []
+        if start is None:
+            p, n = self.bucket.page_node(self.bucket.root_pgid)
+            self.stack.append(ElemRef(p, n, 0))
+            self._first()
+        else:
+            self._search(start, self.bucket.root_pgid)
+
+        count = 0
+        while True:
+            ref = self.stack[-1]
+            for i in range(ref.index, ref.count()):
+                if limit is not None and count >= limit:
+                    return
+                ref.index = i
+                k = ref.key_at(i)
+                if end is not None and k >= end:
+                    return
+                if prefix is not None and not k.startswith(prefix):
+                    return
+                if keys_only:
+                    yield k
+                else:
+                    yield self._pair(*ref.elem(i))
+                count += 1
+            if not self._advance():
+                return
+
+    def seek_le(self, key):
+        """move to the greatest key <= key"""
+        k, v, flags = self._seek(key)
+        if k != key:
+            k, v, flags = self._prev()
+        return self._pair(k, v, flags)
 
     def seek(self, key):
         k, v, flags = self._seek(key)
@@ -73,8 +170,15 @@ class Cursor:
 
         if k is None:
             return None, None
+        return self._pair(k, v, flags)
+
+    def _pair(self, k, v, flags):
+        # what the public methods return: no value for buckets, values
+        # decompressed only now that they're asked for
         if flags & 0x1:
             return k, None
+        if flags & compressedValueFlag:
+            v = self.bucket.decompress(v)
         return k, v
 
     def _first(self):
@@ -83,11 +187,7 @@ class Cursor:
             ref = self.stack[-1]
             if ref.is_leaf():
                 break
-            if ref.node is not None:
-                pgid = ref.node.inodes[ref.index].pgid
-            else:
-                pgid = ref.page.branch_elems()[ref.index].pgid
-            p, n = self.bucket.page_node(pgid)
+            p, n = self.bucket.page_node(ref.child_pgid())
             self.stack.append(ElemRef(p, n, 0))
 
     def _last(self):
@@ -96,16 +196,18 @@ class Cursor:
             ref = self.stack[-1]
             if ref.is_leaf():
                 break
-            if ref.node is not None:
-                pgid = ref.node.inodes[ref.index].pgid
-            else:
-                pgid = ref.page.branch_elems()[ref.index].pgid
-            p, n = self.bucket.page_node(pgid)
+            p, n = self.bucket.page_node(ref.child_pgid())
             ref = ElemRef(p, n, 0)
             ref.index = ref.count() - 1
             self.stack.append(ref)
 
     def _next(self):
+        if not self._advance():
+            return None, None, 0
+        return self.key_value()
+
+    def _advance(self):
+        # step to the next element, crossing over to the next non-empty leaf
         while True:
             i = len(self.stack) - 1
             while i >= 0:
@@ -116,55 +218,82 @@ class Cursor:
                 i -= 1
 
             if i == -1:
-                return None, None, 0
+                return False
 
-            self.stack = self.stack[:i+1]
+            del self.stack[i+1:]
             self._first()
 
+            if self.stack[-1].count() == 0:
+                continue
+
+            return True
+
+    def _prev(self):
+        while True:
+            i = len(self.stack) - 1
+            while i >= 0:
+                ref = self.stack[i]
+                if ref.index > 0:
+                    ref.index -= 1
+                    break
+                i -= 1
+
+            if i == -1:
+                return None, None, 0
+
+            del self.stack[i+1:]
+            self._last()
+
             if self.stack[-1].count() == 0:
                 continue
 
             return self.key_value()
 
-    def _seek(self, key):
-        self.stack = []
-        self._search(key, self.bucket.root_pgid)
-        return self.key_value()
+    def _seek(self, key, copy=True):
+        # climb the saved stack only until key is known to be below, then
+        # search down from there
+        stack = self.stack
+        i = len(stack) - 1
+        while i > 0 and not stack[i].covers(key):
+            i -= 1
+        if i > 0 and self._fresh():
+            del stack[i+1:]
+            self._descend(key)
+        else:
+            self.stack = []
+            self._search(key, self.bucket.root_pgid)
+        return self.key_value(copy)
+
+    def _fresh(self):
+        # pages on the stack that were materialized since are out of date
+        nodes = self.bucket.nodes
+        for ref in self.stack:
+            if ref.node is None and ref.page.id in nodes:
+                return False
+        return True
 
     def _search(self, key, pgid):
         p, n = self.bucket.page_node(pgid)
-        ref = ElemRef(p, n, 0)
-        self.stack.append(ref)
+        self.stack.append(ElemRef(p, n, 0))
+        self._descend(key)
 
-        if ref.is_leaf():
-            if n is not None:
-                inodes = n.inodes
-            else:
-                inodes = ref.page.leaf_elems()
-            ref.index = bisect_left(inodes, key)
-        else:
-            if n is not None:
-                inodes = n.inodes
-            else:
-                inodes = p.branch_elems()
-            index = bisect_left(inodes, key)
-            if index == len(inodes) or (index > 0 and inodes[index].key != key):
-                index -= 1
-            ref.index = index
-            self._search(key, inodes[index].pgid)
-
-    def key_value(self):
+    def _descend(self, key):
+        ref = self.stack[-1]
+        while True:
+            ref.index = ref.search(key)
+            if ref.is_leaf():
+                return
+            p, n = self.bucket.page_node(ref.child_pgid())
+            ref = ElemRef(p, n, 0)
+            self.stack.append(ref)
+
+    def key_value(self, copy=True):
         ref = self.stack[-1]
 
         if ref.count() == 0 or ref.index >= ref.count():
             return None, None, 0
 
-        if ref.node is not None:
-            n = ref.node.inodes[ref.index]
-        else:
-            n = ref.page.leaf_elems()[ref.index]
-
-        return n.key, n.value, n.flags
+        return ref.elem(ref.index, copy)
 
     def node(self):
         ref = self.stack[-1]
@@ -4,25 +4,44 @@ import mmap
 import threading
 import contextlib
 
+from .batch import Batch, Call
+from .cache import PageCache
 from .freelist import FreeList
-from .page import page_from_data
+from .mapping import Mapping
+from .page import page_from_data, page_runs
 from .tx import Tx
-from .rwlock import RWLock
 from .share import leafPageFlag, metaPageFlag, freelistPageFlag, \
-    page_struct, meta_tuple, meta_struct
+    page_struct, meta_tuple, meta_struct, NO_FREELIST
 
 
 PAGESIZE = 4096
 
-NO_FREELIST = 0xffffffffffffffff
+MIN_MMAP_SIZE = 1 << 15   # 32KB
+MAX_MMAP_STEP = 1 << 30   # 1GB
+
+# durability modes
+SYNC_FULL = "full"          # flush on every commit
+SYNC_NONE = "none"          # leave it to the OS, or to db.sync()
+SYNC_DEFERRED = "deferred"  # flush every sync_interval seconds / sync_commits commits
 
 
 class BoltDB:
 
-    def __init__(self, filename, readonly=False):
+    def __init__(self, filename, readonly=False,
+                 page_cache_size=1024, page_cache_bytes=None,
+                 max_batch_size=1000, max_batch_delay=0.01,
+                 sync=SYNC_FULL, sync_interval=None, sync_commits=None,
+                 initial_mmap_size=0, max_grow_step=MAX_MMAP_STEP,
+                 freelist_sync=True):
+        self.closed = True
+        if sync not in (SYNC_FULL, SYNC_NONE, SYNC_DEFERRED):
+            raise Exception("invalid sync mode")
+        if sync == SYNC_DEFERRED and not (sync_interval or sync_commits):
+            raise Exception("deferred sync needs sync_interval or sync_commits")
         self.filename = filename
         self.readonly = readonly
         self.fd = os.open(filename, os.O_RDWR | os.O_CREAT, 0o666)
+        self.closed = False
         if readonly:
             fcntl.lockf(self.fd, fcntl.LOCK_SH)
         else:
@@ -30,25 +49,78 @@ class BoltDB:
         self.datasz = os.fstat(self.fd).st_size
         if self.datasz == 0:
             self._init_db_file()
-        self.mmap = memoryview(mmap.mmap(self.fd, self.datasz, access=mmap.ACCESS_WRITE))
+        self.max_grow_step = max_grow_step
+        if not readonly and initial_mmap_size > self.datasz:
+            self.datasz = initial_mmap_size
+            os.ftruncate(self.fd, self.datasz)
+        self.mapping = Mapping(self.fd, self.datasz)
         self.meta0 = meta_tuple._make(meta_struct.unpack(
-            self.mmap[page_struct.size:page_struct.size+meta_struct.size]))
+            self.mapping.data[page_struct.size:page_struct.size+meta_struct.size]))
         self.pagesize = self.meta0.pageSize
-        self.max_pgid = self.datasz // self.pagesize
+        self.max_pgid = self.meta().max_pgid
 
         self.lock = threading.Lock()
         self.meta_lock = threading.Lock()
-        self.mmap_lock = RWLock()
+        self.txs = []
+
+        self.max_batch_size = max_batch_size
+        self.max_batch_delay = max_batch_delay
+        self.batch_lock = threading.Lock()
+        self.pending_batch = None
+
+        if page_cache_size:
+            self.page_cache = PageCache(page_cache_size, page_cache_bytes)
+        else:
+            self.page_cache = None
+
+        self.sync_mode = sync
+        self.sync_commits = sync_commits
+        self.sync_lock = threading.Lock()
+        self.unsynced = set()
+        self.commits = 0
+        self.sync_stop = threading.Event()
+        self.sync_thread = None
+        if sync == SYNC_DEFERRED and sync_interval:
+            self.sync_thread = threading.Thread(
+                target=self._sync_loop, args=(sync_interval,), daemon=True)
+            self.sync_thread.start()
 
+        # without freelist sync, commits skip writing the freelist and the
+        # next open rebuilds it in the background by scanning the tree
+        self.freelist_sync = freelist_sync
+        self.freelist_loader = None
+        # until the scan is done, commits keep meta.freelist at NO_FREELIST
+        # so a crash leaves the rebuild to the next open
+        self.freelist_loaded = True
+        self.freelist_error = None
         if readonly:
             self.freelist = None
         else:
             self.freelist = FreeList()
             meta = self.meta()
-            if meta.freelist == NO_FREELIST:
-                self.freelist.read_ids(self.freepages())
-            else:
+            if meta.freelist != NO_FREELIST:
                 self.freelist.read(self.page(meta.freelist))
+            else:
+                self.freelist_loaded = False
+                # the scan's snapshot is taken now: pages writers free from
+                # here on stay pending until it's done, so none is found twice
+                tx = self.begin()
+                self.freelist_loader = threading.Thread(
+                    target=self._load_freelist, args=(tx,), daemon=True)
+                self.freelist_loader.start()
+
+    def _load_freelist(self, tx):
+        try:
+            ids = self.freepages(tx)
+        except Exception as e:
+            # raised again by close()
+            self.freelist_error = e
+            return
+        finally:
+            tx.close()
+        with self.lock:
+            self.freelist.release_ids(ids)
+            self.freelist_loaded = True
 
     def _init_db_file(self):
         buf = memoryview(bytearray(PAGESIZE*4))
@@ -78,10 +150,11 @@ class BoltDB:
         os.fsync(self.fd)
 
     def meta(self):
+        data = self.mapping.data
         self.meta0 = meta_tuple._make(meta_struct.unpack(
-            self.mmap[page_struct.size:page_struct.size+meta_struct.size]))
+            data[page_struct.size:page_struct.size+meta_struct.size]))
         self.meta1 = meta_tuple._make(meta_struct.unpack(
-            self.mmap[self.pagesize+page_struct.size:self.pagesize+page_struct.size+meta_struct.size]))
+            data[self.pagesize+page_struct.size:self.pagesize+page_struct.size+meta_struct.size]))
         return self.meta1 if self.meta1.txid > self.meta0.txid else self.meta0
 
     def begin(self, writable=False):
@@ -92,10 +165,12 @@ class BoltDB:
 
         self.meta_lock.acquire()
         tx = Tx(self, writable)
+        if not writable:
+            self.txs.append(tx)
         self.meta_lock.release()
 
-        if not writable:
-            self.mmap_lock.r_acquire()
+        if writable:
+            self.release_pending()
 
         return tx
 
@@ -106,7 +181,7 @@ class BoltDB:
             yield tx
             tx.commit()
         except: # noqa
-            self.freelist.rollback()
+            tx.rollback()
             raise
         finally:
             tx.close()
@@ -119,51 +194,199 @@ class BoltDB:
         finally:
             tx.close()
 
-    def page(self, pgid):
-        return page_from_data(self.mmap[self.pagesize*pgid:])
+    def batch(self, fn):
+        """call fn(tx) as part of a write tx shared with other callers
+
+        fn may be called more than once and must be idempotent.
+        """
+        call = Call(fn)
+        with self.batch_lock:
+            b = self.pending_batch
+            if b is None or len(b.calls) >= self.max_batch_size:
+                b = self.pending_batch = Batch(self)
+            b.calls.append(call)
+            if len(b.calls) >= self.max_batch_size:
+                threading.Thread(target=b.trigger, daemon=True).start()
+
+        call.done.wait()
+        if call.solo:
+            with self.update() as tx:
+                fn(tx)
+        elif call.err is not None:
+            raise call.err
+
+    def remove_tx(self, tx):
+        with self.meta_lock:
+            self.txs.remove(tx)
+
+    def release_pending(self):
+        # free pages that no open reader can still reach
+        with self.meta_lock:
+            if self.txs:
+                txid = min(tx.meta.txid for tx in self.txs)
+            else:
+                txid = self.meta().txid
+        self.freelist.release(txid)
+
+    def page(self, pgid, mapping=None):
+        mapping = mapping or self.mapping
+        return page_from_data(mapping.data[self.pagesize*pgid:])
+
+    def cached_page(self, pgid, mapping=None):
+        if self.page_cache is None:
+            return self.page(pgid, mapping)
+        p = self.page_cache.get(pgid)
+        if p is None:
+            p = self.page(pgid, mapping)
+            if not p.is_branch():
+                # leaves stay lazy views of the mmap, only the few hot
+                # branch pages every lookup walks through are worth decoding
+                return p
+            p = p.decoded()
+            self.page_cache.put(p, (p.overflow+1)*self.pagesize)
+        return p
+
+    def write_pages(self, pgids):
+        if self.sync_mode == SYNC_FULL:
+            self.flush_pages(pgids)
+        else:
+            with self.sync_lock:
+                self.unsynced.update(pgids)
+
+    def committed(self):
+        if self.sync_mode != SYNC_DEFERRED or not self.sync_commits:
+            return
+        with self.sync_lock:
+            self.commits += 1
+            due = self.commits >= self.sync_commits
+        if due:
+            self.sync()
+
+    def sync(self):
+        # the writer lock keeps a commit from writing a newer meta into
+        # the mmap between the data flush and the meta flush
+        with self.lock:
+            with self.sync_lock:
+                pgids, self.unsynced = self.unsynced, set()
+                self.commits = 0
+            if not pgids:
+                return
+            # meta pages last, so they never point at unflushed data
+            metas = pgids & {0, 1}
+            self.flush_pages(pgids - metas)
+            self.flush_pages(metas)
+
+    def _sync_loop(self, interval):
+        while not self.sync_stop.wait(interval):
+            self.sync()
+
+    def flush_pages(self, pgids):
+        for start, count in page_runs(pgids):
+            self.flush_range(start*self.pagesize, count*self.pagesize)
+
+    def flush_range(self, offset, size):
+        # msync wants an offset aligned to the OS page size
+        align = offset % mmap.PAGESIZE
+        mapping = self.acquire_mapping()
+        try:
+            mapping.mmap.flush(offset-align, size+align)
+        finally:
+            mapping.release()
+
+    def acquire_mapping(self):
+        with self.meta_lock:
+            return self.mapping.acquire()
 
     def allocate(self, n):
         pgid = self.freelist.allocate(n)
         if pgid == 0:
             if (self.max_pgid + n) * self.pagesize > self.datasz:
-                self.datasz = (self.max_pgid + n + 4) * self.pagesize
-                os.ftruncate(self.fd, self.datasz)
-                self.mmap_lock.w_acquire()
-                self.mmap.release()
-                self.mmap = memoryview(mmap.mmap(self.fd, self.datasz, access=mmap.ACCESS_WRITE))
-                self.mmap_lock.w_release()
+                self.grow((self.max_pgid + n) * self.pagesize)
             pgid = self.max_pgid
             self.max_pgid += n
             for i in range(n):
                 self.freelist.allocate_new(pgid+i)
+        elif self.page_cache is not None:
+            for i in range(n):
+                self.page_cache.discard(pgid+i)
 
         p = self.page(pgid)
         p.id = pgid
         p.overflow = n - 1
         return p
 
-    def freepages(self):
+    def release_tail(self, pgid, n):
+        """give back pages just allocated at the end of the file, if they are"""
+        if pgid + n != self.max_pgid:
+            return False
+        self.max_pgid = pgid
+        self.freelist.unallocate(range(pgid, pgid+n))
+        return True
+
+    def mmap_size(self, size):
+        # double up to max_grow_step, then grow by max_grow_step at a time
+        step = self.max_grow_step
+        if size <= step:
+            sz = MIN_MMAP_SIZE
+            while sz < size:
+                sz *= 2
+            size = min(sz, step)
+        elif size % step:
+            size += step - size % step
+        if size % self.pagesize:
+            size += self.pagesize - size % self.pagesize
+        return size
+
+    def grow(self, size):
+        self.datasz = self.mmap_size(size)
+        os.ftruncate(self.fd, self.datasz)
+        # txs that began on the old mapping keep using it, nobody waits
+        mapping = Mapping(self.fd, self.datasz)
+        with self.meta_lock:
+            old, self.mapping = self.mapping, mapping
+        old.release()
+
+    def freepages(self, tx=None):
+        # pages not reachable in tx, a new read tx by default
+        if tx is None:
+            with self.view() as tx:
+                return self.freepages(tx)
         ids = []
-        with self.view() as tx:
-            reachable = {}
-            tx.check_bucket(tx.root, reachable)
-            for i in range(2, tx.meta.max_pgid):
-                if i not in reachable:
-                    ids.append(i)
+        reachable = {}
+        if tx.meta.freelist != NO_FREELIST:
+            p = self.page(tx.meta.freelist, tx.mapping)
+            reachable.update(dict.fromkeys(range(p.id, p.id+p.overflow+1), True))
+        tx.check_bucket(tx.root, reachable)
+        for i in range(2, tx.meta.max_pgid):
+            if i not in reachable:
+                ids.append(i)
         return ids
 
     def close(self):
+        if self.closed:
+            return
+        self.closed = True
+
+        if self.sync_thread is not None:
+            self.sync_stop.set()
+            self.sync_thread.join()
+        if self.sync_mode == SYNC_DEFERRED:
+            self.sync()
+        if self.freelist_loader is not None:
+            self.freelist_loader.join()
+
+        # wait for the writer, open readers hold on to their own mapping
         self.lock.acquire()
         self.meta_lock.acquire()
-        self.mmap_lock.w_acquire()
-
-        self.mmap_lock.w_release()
+        self.mapping.release()
         self.meta_lock.release()
         self.lock.release()
 
         fcntl.lockf(self.fd, fcntl.LOCK_UN)
-        self.mmap.release()
         os.close(self.fd)
 
+        if self.freelist_error is not None:
+            raise Exception("freelist scan failed") from self.freelist_error
+
     def __del__(self):
         self.close()
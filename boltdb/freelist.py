@@ -1,14 +1,33 @@
+import heapq
+from bisect import bisect_left, insort
+from itertools import chain
+
+from .page import page_runs
 from .share import page_struct, freelistPageFlag
 
 
 class FreeList:
+    """free pages kept as runs, indexed by start, by end and by length"""
 
     def __init__(self):
-        self.ids = []
-        self.pending = []
+        self.forward = {}   # start -> length
+        self.backward = {}  # last id -> start
+        self.sizes = {}     # length -> set of starts
+        self.lengths = []   # sorted lengths present in self.sizes
+        self.nfree = 0
+        self.pending = {}   # txid -> ids freed by that tx
         self.allocs = []
         self.cache = set()
 
+    @property
+    def ids(self):
+        return list(self._free_ids())
+
+    def _free_ids(self):
+        # in order, straight from the runs
+        return chain.from_iterable(range(start, start+self.forward[start])
+                                   for start in sorted(self.forward))
+
     def size(self):
         n = self.count()
         if n >= 0xffff:
@@ -19,65 +38,115 @@ class FreeList:
         return self.free_count() + self.pending_count()
 
     def free_count(self):
-        return len(self.ids)
+        return self.nfree
 
     def pending_count(self):
-        return len(self.pending_count)
+        return sum(len(ids) for ids in self.pending.values())
 
     def allocate(self, n):
-        if len(self.ids) == 0:
+        # best fit: the shortest run that holds n pages
+        i = bisect_left(self.lengths, n)
+        if i == len(self.lengths):
             return 0
-        initial = previd = 0
-        for i, id in enumerate(self.ids):
-            if previd == 0 or id - previd != 1:
-                initial = id
-            if id - initial + 1 == n:
-                if i + 1 == n:
-                    self.ids = self.ids[i+1:]
-                else:
-                    del self.ids[i-n+1:i+1]
-                for i in range(n):
-                    self.cache.remove(i+initial)
-                    self.allocs.append(i+initial)
-                return initial
-            previd = id
-        return 0
+        length = self.lengths[i]
+        start = next(iter(self.sizes[length]))
+        self._del_run(start, length)
+        if length > n:
+            self._add_run(start+n, length-n)
+        self.nfree -= n
+        for id in range(start, start+n):
+            self.cache.remove(id)
+            self.allocs.append(id)
+        return start
 
     def allocate_new(self, pid):
         self.allocs.append(pid)
 
-    def free(self, p):
-        if p.id <= 1:
+    def unallocate(self, ids):
+        # ids handed back to the end of the file, nothing to release
+        ids = set(ids)
+        self.allocs[:] = [id for id in self.allocs if id not in ids]
+
+    def free(self, txid, p):
+        self.free_pages(txid, [p])
+
+    def free_pages(self, txid, pages):
+        ids = [p.id+i for p in pages for i in range(p.overflow+1)]
+        if not ids:
+            return
+        if min(ids) <= 1:
             raise Exception("cannot free page 0 or 1")
-        if p.id in self.cache:
+        if not self.cache.isdisjoint(ids):
             raise Exception("page already freed")
-        for i in range(p.overflow+1):
-            self.pending.append(p.id+i)
-            self.cache.add(p.id+i)
+        self.pending.setdefault(txid, []).extend(ids)
+        self.cache.update(ids)
 
-    def rollback(self):
-        self.ids = sorted(self.ids + self.allocs)
-        self.cache.clear()
-        self.pending.clear()
-        for id in self.ids:
-            self.cache.add(id)
+    def release(self, txid):
+        # pages freed by txs up to txid are no longer seen by any reader
+        for tid in [tid for tid in self.pending if tid <= txid]:
+            self._release(self.pending.pop(tid))
+
+    def rollback(self, txid):
+        for id in self.pending.pop(txid, []):
+            self.cache.discard(id)
+        self._release(self.allocs)
+        self.allocs.clear()
 
     def read(self, p):
         if p.flags != freelistPageFlag:
             raise Exception("invalid freelist page")
-        self.ids = p.free_ids()
-        self.cache = set()
-        for id in self.ids:
-            self.cache.add(id)
+        self.read_ids(p.free_ids())
 
     def read_ids(self, ids):
-        self.ids = ids
-        self.cache = set()
-        for id in self.ids:
-            self.cache.add(id)
+        self.forward.clear()
+        self.backward.clear()
+        self.sizes.clear()
+        self.lengths.clear()
+        self.cache.clear()
+        self.nfree = 0
+        self._release(ids)
+
+    def release_ids(self, ids):
+        self._release(ids)
 
     def write(self, p):
-        self.ids = sorted(self.ids+self.pending)
+        # pending pages are free as far as a reopened db is concerned
         self.allocs.clear()
-        self.pending.clear()
-        p.write_ids(self.ids)
+        pending = [sorted(ids) for ids in self.pending.values()]
+        p.write_ids(heapq.merge(self._free_ids(), *pending))
+
+    def _release(self, ids):
+        for start, length in page_runs(ids):
+            self._merge_run(start, length)
+            self.nfree += length
+            self.cache.update(range(start, start+length))
+
+    def _merge_run(self, start, length):
+        prev = self.backward.get(start-1)
+        if prev is not None:
+            prev_length = self.forward[prev]
+            self._del_run(prev, prev_length)
+            start, length = prev, length + prev_length
+        next_length = self.forward.get(start+length)
+        if next_length is not None:
+            self._del_run(start+length, next_length)
+            length += next_length
+        self._add_run(start, length)
+
+    def _add_run(self, start, length):
+        self.forward[start] = length
+        self.backward[start+length-1] = start
+        starts = self.sizes.get(length)
+        if starts is None:
+            starts = self.sizes[length] = set()
+            insort(self.lengths, length)
+        starts.add(start)
+
+    def _del_run(self, start, length):
+        del self.forward[start]
+        del self.backward[start+length-1]
+        starts = self.sizes[length]
+        starts.remove(start)
+        if not starts:
+            del self.sizes[length]
+            del self.lengths[bisect_left(self.lengths, length)]
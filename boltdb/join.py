@@ -0,0 +1,79 @@
+import heapq
+
+
+def _cursors(buckets):
+    if not buckets:
+        raise Exception("no buckets given")
+    tx = buckets[0].tx
+    for b in buckets:
+        if b.tx is not tx:
+            raise Exception("buckets must belong to the same tx")
+    return [b.cursor() for b in buckets]
+
+
+def _scan(i, c):
+    k, v = c.first()
+    while k is not None:
+        yield k, i, v
+        k, v = c.next()
+
+
+def merge(*buckets):
+    """yield (key, values) over the union of the keys of buckets, in order
+
+    values holds one value per bucket, None where the key is missing.
+    """
+    cursors = _cursors(buckets)
+    key, values = None, None
+    for k, i, v in heapq.merge(*[_scan(i, c) for i, c in enumerate(cursors)]):
+        if k != key:
+            if values is not None:
+                yield key, values
+            key, values = k, [None] * len(cursors)
+        values[i] = v
+    if values is not None:
+        yield key, values
+
+
+def intersect(*buckets):
+    """yield (key, values) for the keys found in every bucket
+
+    Cursors behind the largest current key seek straight to it, so gaps
+    between matches are skipped rather than stepped through.
+    """
+    cursors = _cursors(buckets)
+    pairs = [c.first() for c in cursors]
+    while True:
+        hi = None
+        for k, _ in pairs:
+            if k is None:
+                return
+            if hi is None or k > hi:
+                hi = k
+        if all(k == hi for k, _ in pairs):
+            yield hi, [v for _, v in pairs]
+            pairs = [c.next() for c in cursors]
+            continue
+        for i, c in enumerate(cursors):
+            if pairs[i][0] < hi:
+                pairs[i] = c.seek(hi)
+
+
+def anti_join(bucket, *others):
+    """yield (key, value) from bucket for keys found in none of others"""
+    cursors = _cursors((bucket,) + others)
+    c, cursors = cursors[0], cursors[1:]
+    pairs = [None] * len(cursors)
+    k, v = c.first()
+    while k is not None:
+        found = False
+        for i, o in enumerate(cursors):
+            ok = pairs[i]
+            if ok is None or (ok[0] is not None and ok[0] < k):
+                ok = pairs[i] = o.seek(k)
+            if ok[0] == k:
+                found = True
+                break
+        if not found:
+            yield k, v
+        k, v = c.next()
@@ -0,0 +1,34 @@
+import mmap
+import threading
+
+
+class Mapping:
+    """a mmap of the db file, shared by the db and the txs that began on it
+
+    Growing the file swaps in a new Mapping instead of waiting for readers;
+    the old one is released when its last tx closes.
+    """
+
+    def __init__(self, fd, size):
+        self.size = size
+        self.mmap = mmap.mmap(fd, size, access=mmap.ACCESS_WRITE)
+        self.data = memoryview(self.mmap)
+        self.refs = 1
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        with self.lock:
+            self.refs += 1
+        return self
+
+    def release(self):
+        with self.lock:
+            self.refs -= 1
+            if self.refs > 0:
+                return
+        self.data.release()
+        try:
+            self.mmap.close()
+        except BufferError:
+            # pages sliced from it are still around, gc unmaps it after them
+            pass
@@ -1,25 +1,29 @@
-import functools
 from bisect import bisect_left
 
 from .share import page_struct, leaf_elem_struct, branch_elem_struct
 
 
-@functools.total_ordering
+MIN_FILL_PERCENT = 0.1
+MAX_FILL_PERCENT = 1.0
+DEFAULT_FILL_PERCENT = 0.75
+# fewest inodes either half of a split is left with
+MIN_KEYS_PER_PAGE = 2
+
+
 class Inode:
+    __slots__ = ("key", "value", "pgid", "flags")
+
     def __init__(self, key, value, pgid, flags):
         self.key = key
         self.value = value
         self.pgid = pgid
         self.flags = flags
 
-    def __eq__(self, other):
-        return self.key == other
-
-    def __lt__(self, other):
-        return self.key < other
-
 
 class Node:
+    __slots__ = ("bucket", "is_leaf", "unbalanced", "spilled", "key", "pgid",
+                 "parent", "children", "inodes", "keys", "payload", "appended",
+                 "inserted")
 
     def __init__(self, bucket):
         self.bucket = bucket
@@ -31,6 +35,13 @@ class Node:
         self.parent = None
         self.children = []
         self.inodes = []
+        # the keys of inodes, so bisect compares plain bytes
+        self.keys = []
+        # bytes of keys and values in inodes, kept up to date by every change
+        self.payload = 0
+        # how keys were added since the node was read, see split_two
+        self.appended = False
+        self.inserted = False
 
     def root(self):
         if self.parent is None:
@@ -38,12 +49,9 @@ class Node:
         return self.parent.root()
 
     def size(self):
-        sz = page_struct.size
         elsz = leaf_elem_struct.size \
             if self.is_leaf else branch_elem_struct.size
-        for n in self.inodes:
-            sz += elsz + len(n.key) + len(n.value)
-        return sz
+        return page_struct.size + elsz * len(self.inodes) + self.payload
 
     def child_at(self, index):
         if self.is_leaf:
@@ -51,7 +59,7 @@ class Node:
         return self.bucket.node(self.inodes[index].pgid, self)
 
     def child_index(self, n):
-        return bisect_left(self.inodes, n.key)
+        return bisect_left(self.keys, n.key)
 
     def num_children(self):
         return len(self.inodes)
@@ -60,7 +68,7 @@ class Node:
         if self.parent is None:
             return None
         index = self.parent.child_index(self)
-        if index >= self.parent.num_children():
+        if index >= self.parent.num_children() - 1:
             return None
         return self.parent.child_at(index+1)
 
@@ -73,30 +81,43 @@ class Node:
         return self.parent.child_at(index-1)
 
     def put(self, old_key, new_key, value, pgid, flags):
-        index = bisect_left(self.inodes, old_key)
-        exact = self.inodes and index < len(self.inodes) and \
-            self.inodes[index].key == old_key
+        keys = self.keys
+        index = bisect_left(keys, old_key)
         n = Inode(new_key, value, pgid, flags)
-        if exact:
+        self.payload += len(new_key) + len(value)
+        if index < len(keys) and keys[index] == old_key:
+            old = self.inodes[index]
+            self.payload -= len(old.key) + len(old.value)
             self.inodes[index] = n
+            keys[index] = new_key
+        elif index == len(keys):
+            self.inodes.append(n)
+            keys.append(new_key)
+            self.appended = True
         else:
             self.inodes.insert(index, n)
+            keys.insert(index, new_key)
+            self.inserted = True
 
     def delete(self, key):
         if not self.inodes:
             return
-        index = bisect_left(self.inodes, key)
-        if index >= len(self.inodes) or self.inodes[index] != key:
+        index = bisect_left(self.keys, key)
+        if index >= len(self.keys) or self.keys[index] != key:
             return
-        self.inodes.pop(index)
+        n = self.inodes.pop(index)
+        del self.keys[index]
+        self.payload -= len(n.key) + len(n.value)
         self.unbalanced = True
 
     def read(self, p):
         if p.is_leaf():
             self.is_leaf = True
-            self.inodes = p.leaf_elems()
+            self.inodes = list(p.leaf_elems())
         else:
-            self.inodes = p.branch_elems()
+            self.inodes = list(p.branch_elems())
+        self.keys = list(p.keys)
+        self.payload = sum(len(n.key) + len(n.value) for n in self.inodes)
         if len(self.inodes) > 0:
             self.key = self.inodes[0].key
 
@@ -130,7 +151,7 @@ class Node:
             # else:
             #     p = None
             if n.pgid > 0:
-                tx.db.freelist.free(tx.page(n.pgid))
+                tx.db.freelist.free(tx.txid, tx.page(n.pgid))
             p = self.bucket.tx.allocate((n.size()+tx.db.pagesize-1)//tx.db.pagesize)
             n.pgid = p.id
             n.write(p)
@@ -156,11 +177,16 @@ class Node:
 
     def split_two(self, pagesize):
         # print("split me", id(self), self.size())
-        if len(self.inodes) <= 2 or self.size() < pagesize:
+        if len(self.inodes) <= MIN_KEYS_PER_PAGE * 2 or self.size() <= pagesize:
             return self, None
 
-        # i = len(self.inodes) // 2
-        i = self._split_index(pagesize*3/4)
+        # append-only nodes, e.g. time-ordered keys, never get keys in the
+        # middle again, so pack them full instead of leaving room
+        if self.appended and not self.inserted:
+            fill = MAX_FILL_PERCENT
+        else:
+            fill = min(max(self.bucket.fill_percent, MIN_FILL_PERCENT), MAX_FILL_PERCENT)
+        i = self._split_index(pagesize*fill)
         if self.parent is None:
             p = Node(self.bucket)
             p.children = [self]
@@ -168,45 +194,50 @@ class Node:
 
         next = Node(self.bucket)
         next.is_leaf = self.is_leaf
+        next.appended = self.appended
+        next.inserted = self.inserted
         next.parent = self.parent
         next.parent.children.append(next)
 
-        inodes = self.inodes
-        next.inodes = inodes[i:]
-        self.inodes = inodes[:i]
+        inodes, keys = self.inodes, self.keys
+        next.inodes, next.keys = inodes[i:], keys[i:]
+        self.inodes, self.keys = inodes[:i], keys[:i]
+        next.payload = sum(len(n.key) + len(n.value) for n in next.inodes)
+        self.payload -= next.payload
         return self, next
 
     def _split_index(self, threshold):
         sz = page_struct.size
         elsz = leaf_elem_struct.size \
             if self.is_leaf else branch_elem_struct.size
-        for i, n in enumerate(self.inodes):
-            sz += elsz + len(n.key) + len(n.value)
-            if i >= 2 and sz > threshold:
-                return i
+        # like bolt's splitIndex, both halves keep MIN_KEYS_PER_PAGE inodes
+        index = 0
+        for i in range(len(self.inodes) - MIN_KEYS_PER_PAGE):
+            index = i
+            n = self.inodes[i]
+            elsize = elsz + len(n.key) + len(n.value)
+            if i >= MIN_KEYS_PER_PAGE and sz + elsize > threshold:
+                break
+            sz += elsize
+        return index
 
     def rebalance(self):
         if not self.unbalanced:
             return
         self.unbalanced = False
 
-        # print("rebalance", self.pgid, len(self.inodes))
-
         threshold = self.bucket.tx.db.pagesize/4
-        if self.size() > threshold and len(self.inodes) > 2:
+        if self.size() > threshold and len(self.inodes) > self.min_keys():
             return
 
         if self.parent is None:
-            if self.num_children() == 0:
-                self.is_leaf = True
-            return
-
-            # or this
-
+            # collapse a root branch with a single child
             if not self.is_leaf and len(self.inodes) == 1:
                 child = self.bucket.node(self.inodes[0].pgid, self)
                 self.is_leaf = child.is_leaf
                 self.inodes = child.inodes[:]
+                self.keys = child.keys[:]
+                self.payload = child.payload
                 self.children = child.children
 
                 for i in self.inodes:
@@ -216,7 +247,8 @@ class Node:
                 child.parent = None
                 del self.bucket.nodes[child.pgid]
                 child.free()
-
+            elif self.num_children() == 0:
+                self.is_leaf = True
             return
 
         if self.num_children() == 0:
@@ -225,12 +257,47 @@ class Node:
             del self.bucket.nodes[self.pgid]
             self.free()
             self.parent.rebalance()
+            return
+
+        if self.parent.num_children() == 1:
+            # no sibling to merge with, the parent merges with its own instead
+            self.parent.unbalanced = True
+            self.parent.rebalance()
+            return
+
+        # merge into the left sibling, or pull in the right one for the first child
+        if self.parent.child_index(self) == 0:
+            self.merge(self.next_sibling())
+        else:
+            self.prev_sibling().merge(self)
+        self.parent.rebalance()
+
+    def merge(self, other):
+        # move other's inodes to the end of self, other goes away
+        for i in other.inodes:
+            child = self.bucket.nodes.get(i.pgid)
+            if child is not None and not other.is_leaf:
+                child.parent.remove_child(child)
+                child.parent = self
+                self.children.append(child)
+        self.inodes.extend(other.inodes)
+        self.keys.extend(other.keys)
+        self.payload += other.payload
+        self.parent.delete(other.key)
+        self.parent.remove_child(other)
+        del self.bucket.nodes[other.pgid]
+        other.free()
+
+    def min_keys(self):
+        return 1 if self.is_leaf else 2
 
     def remove_child(self, child):
-        self.children.remove(child)
+        if child in self.children:
+            self.children.remove(child)
 
     def free(self):
         if self.pgid != 0:
-            # freelist
-            pass
+            tx = self.bucket.tx
+            tx.db.freelist.free(tx.txid, tx.page(self.pgid))
+            self.pgid = 0
         self.unbalanced = False
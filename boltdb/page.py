@@ -1,3 +1,8 @@
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+
 from .node import Inode
 from .share import leafPageFlag, branchPageFlag, freelistPageFlag, \
     page_tuple, page_struct, \
@@ -6,6 +11,8 @@ from .share import leafPageFlag, branchPageFlag, freelistPageFlag, \
 
 
 class Page:
+    __slots__ = ("id", "flags", "count", "overflow", "header", "data",
+                 "inodes", "keys")
 
     def __init__(self):
         self.id = 0
@@ -16,6 +23,7 @@ class Page:
         self.header = None
         self.data = None
         self.inodes = None
+        self.keys = None
 
     def is_leaf(self):
         return bool(self.flags & leafPageFlag)
@@ -36,6 +44,7 @@ class Page:
             value = bytes(self.data[pos+e.ksize:pos+e.ksize+e.vsize])
             n = Inode(key, value, 0, e.flags)
             self.inodes.append(n)
+        self.keys = [n.key for n in self.inodes]
         return self.inodes
 
     def branch_elems(self):
@@ -50,39 +59,101 @@ class Page:
             key = bytes(self.data[pos:pos+e.ksize])
             n = Inode(key, b"", e.pgid, 0)
             self.inodes.append(n)
+        self.keys = [n.key for n in self.inodes]
         return self.inodes
 
+    def decoded(self):
+        # a copy detached from the mmap, safe to share between transactions
+        p = Page()
+        p.id = self.id
+        p.flags = self.flags
+        p.count = self.count
+        p.overflow = self.overflow
+        if self.is_leaf():
+            p.inodes = self.leaf_elems()
+        elif self.is_branch():
+            p.inodes = self.branch_elems()
+        p.keys = self.keys
+        return p
+
+    def elem_key(self, index):
+        if self.keys is not None:
+            return self.keys[index]
+        if self.is_leaf():
+            elem_size = leaf_elem_struct.size
+            _, pos, ksize, _ = leaf_elem_struct.unpack_from(self.data, index*elem_size)
+        else:
+            elem_size = branch_elem_struct.size
+            pos, ksize, _ = branch_elem_struct.unpack_from(self.data, index*elem_size)
+        pos += index * elem_size
+        return bytes(self.data[pos:pos+ksize])
+
+    def leaf_elem(self, index, copy=True):
+        # decode a single element, leave the rest of the page untouched
+        if self.inodes is not None:
+            n = self.inodes[index]
+            if copy:
+                return n.key, n.value, n.flags
+            return memoryview(n.key), memoryview(n.value), n.flags
+        elem_size = leaf_elem_struct.size
+        flags, pos, ksize, vsize = leaf_elem_struct.unpack_from(self.data, index*elem_size)
+        pos += index * elem_size
+        key = self.data[pos:pos+ksize]
+        value = self.data[pos+ksize:pos+ksize+vsize]
+        if copy:
+            return bytes(key), bytes(value), flags
+        return key, value, flags
+
+    def branch_pgid(self, index):
+        if self.inodes is not None:
+            return self.inodes[index].pgid
+        _, _, pgid = branch_elem_struct.unpack_from(
+            self.data, index*branch_elem_struct.size)
+        return pgid
+
+    def search(self, key, lo=0):
+        if self.keys is not None:
+            return bisect_left(self.keys, key, lo)
+        return bisect_left(ElemKeys(self), key, lo, self.count)
+
     def write_inodes(self, inodes):
-        self.count = len(inodes)
+        # all element headers go out in one pack, the keys and values in one
+        # copy, instead of a struct.pack and slice assignment per element
+        self.count = count = len(inodes)
         self.inodes = inodes
+        self.keys = [n.key for n in inodes]
+        headers = []
+        payload = []
+        blobs = False
         if self.is_leaf():
             elem_size = leaf_elem_struct.size
+            fmt = "%dI" % (4 * count)
+            off = elem_size * count
+            for n in inodes:
+                ksize, vsize = len(n.key), len(n.value)
+                headers += (n.flags, off, ksize, vsize)
+                payload += (n.key, n.value)
+                blobs = blobs or type(n.value) is memoryview
+                off += ksize + vsize - elem_size
         else:
             elem_size = branch_elem_struct.size
-        off = elem_size * self.count
-        for i in range(self.count):
-            n = self.inodes[i]
-            sz = len(n.key) + len(n.value)
-            if self.is_leaf():
-                pos = i * elem_size
-                # leaf_elem_tuple = namedtuple("leaf_elem", "flags pos ksize vsize")
-                b = leaf_elem_struct.pack(n.flags, off-pos, len(n.key), len(n.value))
-                self.data[pos:pos+len(b)] = b
-                self.data[off:off+len(n.key)] = n.key
-                try:
-                    self.data[off+len(n.key):off+len(n.key)+len(n.value)] = n.value
-                except: # noqa
-                    print(type(n.value), len(n.value))
-                    raise
-            else:
-                pos = i * elem_size
-                # branch_elem_tuple = namedtuple("branch_elem", "pos ksize pgid")
-                b = branch_elem_struct.pack(off-pos, len(n.key), n.pgid)
-                self.data[pos:pos+len(b)] = b
-                self.data[off:off+len(n.key)] = n.key
-                # print("write branch", n.key)
-            off += sz
-        # print("write page", self.id, self.flags, self.count)
+            fmt = branch_elem_struct.format * count
+            off = elem_size * count
+            for n in inodes:
+                ksize = len(n.key)
+                headers += (off, ksize, n.pgid)
+                payload.append(n.key)
+                off += ksize - elem_size
+        struct.pack_into(fmt, self.data, 0, *headers)
+        off = elem_size * count
+        if blobs:
+            # staged values are copied mmap to mmap, not through a join
+            for b in payload:
+                self.data[off:off+len(b)] = b
+                off += len(b)
+        else:
+            buf = b"".join(payload)
+            self.data[off:off+len(buf)] = buf
         self.write_header()
 
     def write_header(self):
@@ -90,19 +161,45 @@ class Page:
         self.header[:] = b
 
     def free_ids(self):
-        ids = []
-        for i in range(self.count):
-            ids.append(int.from_bytes(self.data[i*8:(i+1)*8], "little"))
-        return ids
+        # count overflows into the first element past 0xffff
+        start, count = 0, self.count
+        if count == 0xffff:
+            start, count = 1, int.from_bytes(self.data[:8], "little")
+        ids = array("Q")
+        ids.frombytes(self.data[start*8:(start+count)*8])
+        if sys.byteorder == "big":
+            ids.byteswap()
+        return ids.tolist()
 
     def write_ids(self, ids):
         self.flags = freelistPageFlag
-        self.count = len(ids)
-        for i, id in enumerate(ids):
-            self.data[i*8:(i+1)*8] = id.to_bytes(8, "little")
+        ids = array("Q", ids)
+        start = 0
+        if len(ids) < 0xffff:
+            self.count = len(ids)
+        else:
+            self.count = 0xffff
+            self.data[:8] = len(ids).to_bytes(8, "little")
+            start = 1
+        if sys.byteorder == "big":
+            ids.byteswap()
+        self.data[start*8:(start+len(ids))*8] = ids.tobytes()
         self.write_header()
 
 
+class ElemKeys:
+    """lazy sequence of page keys, only decodes what bisect probes"""
+
+    def __init__(self, page):
+        self.page = page
+
+    def __len__(self):
+        return self.page.count
+
+    def __getitem__(self, index):
+        return self.page.elem_key(index)
+
+
 def page_from_data(data):
     page = Page()
     p = page_tuple._make(page_struct.unpack(data[:page_struct.size]))
@@ -113,6 +210,15 @@ def page_from_data(data):
 
     page.header = data[:page_struct.size]
     page.data = data[page_struct.size:]
-
-    page.from_data = True
     return page
+
+
+def page_runs(pgids):
+    """merge page ids into sorted (start, count) runs of contiguous pages"""
+    runs = []
+    for pgid in sorted(pgids):
+        if runs and runs[-1][0] + runs[-1][1] == pgid:
+            runs[-1][1] += 1
+        else:
+            runs.append([pgid, 1])
+    return [tuple(r) for r in runs]
@@ -1,29 +0,0 @@
-from threading import Lock
-
-
-class RWLock(object):
-
-    def __init__(self):
-        self.w_lock = Lock()
-        self.num_r_lock = Lock()
-        self.num_r = 0
-
-    def r_acquire(self):
-        self.num_r_lock.acquire()
-        self.num_r += 1
-        if self.num_r == 1:
-            self.w_lock.acquire()
-        self.num_r_lock.release()
-
-    def r_release(self):
-        self.num_r_lock.acquire()
-        self.num_r -= 1
-        if self.num_r == 0:
-            self.w_lock.release()
-        self.num_r_lock.release()
-
-    def w_acquire(self):
-        self.w_lock.acquire()
-
-    def w_release(self):
-        self.w_lock.release()
@@ -8,6 +8,12 @@ metaPageFlag = 0x04
 freelistPageFlag = 0x10
 
 bucketLeafFlag = 0x01
+# on a bucket header: a codec_struct follows the bucket_struct
+bucketCodecFlag = 0x02
+# on a value: stored compressed with the codec of its bucket
+compressedValueFlag = 0x04
+
+NO_FREELIST = 0xffffffffffffffff
 
 
 page_tuple = namedtuple('page', 'id flags count overflow')
@@ -24,3 +30,6 @@ branch_elem_struct = struct.Struct("IIQ")
 
 bucket_tuple = namedtuple("bucket", "root dequence")
 bucket_struct = struct.Struct("QQ")
+
+codec_tuple = namedtuple("codec", "codec threshold")
+codec_struct = struct.Struct("II")
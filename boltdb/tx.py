@@ -1,5 +1,6 @@
 from .bucket import Bucket
-from .share import meta_struct
+from .codec import DEFAULT_THRESHOLD
+from .share import meta_struct, bucket_struct, bucketLeafFlag, NO_FREELIST
 
 
 class Tx:
@@ -7,14 +8,19 @@ class Tx:
     def __init__(self, db, writable):
         self.db = db
         self.meta = db.meta()
+        # the caller holds db.meta_lock, so the mapping can't be swapped under us
+        self.mapping = db.mapping.acquire()
         self.root = Bucket(self, self.meta.root_pgid)
 
         self.writable = writable
         self.pages = {}
+        # pages holding streamed values until they're copied into leaves
+        self.staged = []
         if self.writable:
             self.txid = self.meta.txid + 1
 
         self.closed = False
+        self.committed = False
 
     def id(self):
         return self.txid
@@ -28,8 +34,8 @@ class Tx:
         else:
             return self.root.bucket(name)
 
-    def create_bucket(self, name):
-        return self.root.create_bucket(name)
+    def create_bucket(self, name, codec=None, threshold=DEFAULT_THRESHOLD):
+        return self.root.create_bucket(name, codec, threshold)
 
     def delete_bucket(self, name):
         return self.root.delete_bucket(name)
@@ -46,18 +52,31 @@ class Tx:
 
         self.root.spill()
 
+        for p in self.staged:
+            self.db.freelist.free(self.txid, p)
+        self.staged = []
+
         self.commit_freelist()
 
         self.write()
 
         self.write_meta()
 
+        self.db.release_pending()
+
+        self.committed = True
         self.close()
 
+        self.db.committed()
+
     def page(self, pgid):
         if pgid in self.pages:
             return self.pages[pgid]
-        return self.db.page(pgid)
+        return self.db.cached_page(pgid, self.mapping)
+
+    def raw_page(self, pgid):
+        # straight from the mmap, for walks that shouldn't churn the page cache
+        return self.pages.get(pgid) or self.db.page(pgid, self.mapping)
 
     def allocate(self, n):
         p = self.db.allocate(n)
@@ -65,12 +84,24 @@ class Tx:
         return p
 
     def commit_freelist(self):
-        p = self.page(self.meta.freelist)
-        self.db.freelist.write(p)
+        # copy on write, so the freelist the last meta points at stays intact
+        freelist = self.db.freelist
+        if self.meta.freelist != NO_FREELIST:
+            freelist.free(self.txid, self.db.page(self.meta.freelist, self.mapping))
+        if not self.db.freelist_sync or not self.db.freelist_loaded:
+            self.meta = self.meta._replace(freelist=NO_FREELIST)
+            return
+        pagesize = self.db.pagesize
+        p = self.allocate((freelist.size()+pagesize-1)//pagesize)
+        freelist.write(p)
+        self.meta = self.meta._replace(freelist=p.id)
 
     def write(self):
-        # for p in self.pages.values(): p.write_inodes()
-        pass
+        # data pages must hit the disk before the meta page points at them
+        pgids = set()
+        for p in self.pages.values():
+            pgids.update(range(p.id, p.id+p.overflow+1))
+        self.db.write_pages(pgids)
 
     def write_meta(self):
         pgid = self.txid % 2
@@ -88,21 +119,24 @@ class Tx:
             0,
         )
         p.data[:len(new_meta)] = new_meta
-        self.db.mmap.obj.flush()
+        self.db.write_pages([pgid])
 
     def for_each_page(self, pgid):
-        p = self.page(pgid)
+        p = self.raw_page(pgid)
         yield p
         if p.is_branch():
-            for elem in p.branch_elems():
-                self.for_each_page(elem.pgid)
+            for i in range(p.count):
+                yield from self.for_each_page(p.branch_pgid(i))
 
     def check_bucket(self, bucket, reachable):
-        if bucket.root_pgid == 0:
+        self.check_pages(bucket.root_pgid, reachable)
+
+    def check_pages(self, root_pgid, reachable):
+        if root_pgid == 0:
             return
 
-        for p in bucket.tx.for_each_page(bucket.root_pgid):
-            if p.id > self.meta.max_pgid:
+        for p in self.for_each_page(root_pgid):
+            if p.id >= self.meta.max_pgid:
                 raise Exception("page out of bounds")
             for i in range(p.overflow+1):
                 id = p.id + i
@@ -110,21 +144,32 @@ class Tx:
                     raise Exception("multiple references")
                 reachable[id] = True
 
-        for k, v in bucket:
-            if v is not None:
+            if not p.is_leaf():
                 continue
-            child = bucket.bucket(k)
-            self.check_bucket(child, reachable)
+            # only sub bucket headers are decoded, values are never copied
+            for i in range(p.count):
+                _, value, flags = p.leaf_elem(i, copy=False)
+                if flags & bucketLeafFlag:
+                    root, _ = bucket_struct.unpack_from(value)
+                    self.check_pages(root, reachable)
+
+    def rollback(self):
+        self.close()
 
     def close(self):
         if self.closed:
             return
         self.closed = True
 
+        self.mapping.release()
         if self.writable:
+            # the next writer reuses this txid, it mustn't release what this
+            # tx freed or hand out again what it allocated
+            if not self.committed:
+                self.db.freelist.rollback(self.txid)
             self.db.lock.release()
         else:
-            self.db.mmap_lock.r_release()
+            self.db.remove_tx(self)
 
     def __del__(self):
         self.close()
@@ -0,0 +1,72 @@
+import os
+import unittest
+import tempfile
+import threading
+
+from boltdb import BoltDB
+
+
+class TestBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.db = BoltDB(tempfile.mktemp(), max_batch_delay=0.05)
+
+    def tearDown(self):
+        os.unlink(self.db.filename)
+
+    def run_threads(self, fns):
+        errors = []
+
+        def run(fn):
+            try:
+                self.db.batch(fn)
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=run, args=(fn,)) for fn in fns]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return errors
+
+    def put(self, i):
+        def fn(tx):
+            k = str(i).encode()
+            tx.bucket().put(k, k)
+        return fn
+
+    def test_batch(self):
+        n = 20
+        txid = self.db.meta().txid
+        errors = self.run_threads([self.put(i) for i in range(n)])
+        self.assertEqual(errors, [])
+        self.assertLess(self.db.meta().txid - txid, n)
+
+        with self.db.view() as tx:
+            for i in range(n):
+                k = str(i).encode()
+                self.assertEqual(tx.bucket().get(k), k)
+
+    def test_batch_error(self):
+        def fail(tx):
+            tx.bucket().put(b"bad", b"bad")
+            raise ValueError("fail")
+
+        errors = self.run_threads([self.put(i) for i in range(5)] + [fail])
+        self.assertEqual(len(errors), 1)
+        self.assertIsInstance(errors[0], ValueError)
+
+        with self.db.view() as tx:
+            self.assertIsNone(tx.bucket().get(b"bad"))
+            for i in range(5):
+                k = str(i).encode()
+                self.assertEqual(tx.bucket().get(k), k)
+
+    def test_batch_size(self):
+        self.db.max_batch_size = 3
+        self.db.max_batch_delay = 10
+        txid = self.db.meta().txid
+        errors = self.run_threads([self.put(i) for i in range(6)])
+        self.assertEqual(errors, [])
+        self.assertEqual(self.db.meta().txid - txid, 2)
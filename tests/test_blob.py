@@ -0,0 +1,74 @@
+import io
+import os
+import unittest
+import tempfile
+
+from boltdb import BoltDB
+
+
+class TestBlob(unittest.TestCase):
+
+    def setUp(self):
+        self.db = BoltDB(tempfile.mktemp())
+        self.value = os.urandom(3 * 1024 * 1024 + 123)
+
+    def tearDown(self):
+        self.db.close()
+        os.unlink(self.db.filename)
+
+    def test_put_stream(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"blobs")
+            b.put(b"a", b"small")
+            b.put_stream(b"sized", io.BytesIO(self.value), len(self.value))
+            b.put_stream(b"unsized", io.BytesIO(self.value))
+            b.put_stream(b"empty", io.BytesIO(b""))
+            self.assertEqual(b.get(b"sized"), self.value)
+            self.assertIsInstance(b.get(b"unsized"), bytes)
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"blobs")
+            self.assertEqual(b.get(b"sized"), self.value)
+            self.assertEqual(b.get(b"unsized"), self.value)
+            self.assertEqual(b.get(b"empty"), b"")
+            self.assertEqual(b.get(b"a"), b"small")
+
+        # the staged pages went back to the freelist
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+        self.assertGreater(self.db.freelist.free_count(), 2 * len(self.value) // self.db.pagesize)
+
+    def test_put_stream_short(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"blobs")
+            with self.assertRaisesRegex(Exception, "unexpected end of stream"):
+                b.put_stream(b"x", io.BytesIO(b"abc"), 4)
+            self.assertIsNone(b.get(b"x"))
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+    def test_open_blob(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"blobs")
+            b.put(b"value", self.value)
+            b.create_bucket(b"sub")
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"blobs")
+            self.assertIsNone(b.open_blob(b"missing"))
+            self.assertIsNone(b.open_blob(b"sub"))
+
+            f = b.open_blob(b"value")
+            buf = bytearray(1000)
+            self.assertEqual(f.readinto(buf), 1000)
+            self.assertEqual(bytes(buf), self.value[:1000])
+            self.assertEqual(f.read(10), self.value[1000:1010])
+            self.assertEqual(f.seek(-5, io.SEEK_END), len(self.value) - 5)
+            self.assertEqual(f.read(), self.value[-5:])
+            self.assertEqual(f.read(), b"")
+            f.seek(0)
+            self.assertEqual(f.read(), self.value)
+            self.assertEqual(f.getbuffer(), self.value)
+            f.close()
+            self.assertRaises(ValueError, f.read)
+
+            with io.BufferedReader(b.open_blob(b"value")) as r:
+                self.assertEqual(r.read(), self.value)
@@ -1,4 +1,6 @@
+import mmap
 import os
+import random
 import unittest
 import tempfile
 
@@ -26,12 +28,74 @@ class TestBucket(unittest.TestCase):
             v = b.get(b"foo")
             self.assertEqual(v, b"bar")
 
+    def test_get_no_copy(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(1000):
+                k = str(i).encode()
+                b.put(k, k*3)
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"widgets")
+            v = b.get(b"42", copy=False)
+            self.assertIsInstance(v, memoryview)
+            self.assertIsInstance(v.obj, mmap.mmap)
+            self.assertEqual(v, b"424242")
+            # twice, so a second read can't come from a decoded copy either
+            v = b.get(b"42", copy=False)
+            self.assertIsInstance(v.obj, mmap.mmap)
+            self.assertIsNone(b.get(b"4242", copy=False))
+
     def test_get_bucket_is_none(self):
         with self.db.update() as tx:
             tx.create_bucket(b"widgets")
             tx.bucket(b"widgets").create_bucket(b"foo")
             self.assertIsNone(tx.bucket(b"widgets").get(b"foo"))
 
+    def test_get_many(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(0, 10000, 2):
+                k = b"%06d" % i
+                b.put(k, k)
+            b.create_bucket(b"000101")
+            keys = [b"%06d" % i for i in range(0, 10000, 7)]
+            expected = [k if int(k) % 2 == 0 else None for k in keys]
+            keys += [b"000101", b"zzz", b""]
+            expected += [None, None, None]
+            self.assertEqual(b.get_many(keys), expected)
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"widgets")
+            self.assertEqual(b.get_many(keys), expected)
+            self.assertEqual(b.get_many([]), [])
+            self.assertEqual(b.get_many([b"000004", b"000002", b"000004"]),
+                             [b"000004", b"000002", b"000004"])
+
+    def test_put_many(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            b.put_many((b"%06d" % i, b"a") for i in range(0, 10000, 2))
+            b.create_bucket(b"sub")
+
+        with self.db.update() as tx:
+            b = tx.bucket(b"widgets")
+            items = [(b"%06d" % i, b"b") for i in reversed(range(0, 10000, 3))]
+            b.put_many(items)
+            with self.assertRaisesRegex(Exception, "cannot write sub bucket"):
+                b.put_many([(b"sub", b"x")])
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"widgets")
+            for i in range(10000):
+                v = b.get(b"%06d" % i)
+                if i % 3 == 0:
+                    self.assertEqual(v, b"b")
+                elif i % 2 == 0:
+                    self.assertEqual(v, b"a")
+                else:
+                    self.assertIsNone(v)
+
     def test_put(self):
         with self.db.update() as tx:
             b = tx.create_bucket(b"widgets")
@@ -60,6 +124,81 @@ class TestBucket(unittest.TestCase):
                 v = b.get(b"0"*i*factor)
                 self.assertEqual(v, b"X"*(count-1)*factor)
 
+    def count_pages(self, tx, b):
+        return sum(p.overflow+1 for p in tx.for_each_page(b.root_pgid))
+
+    def test_put_sequential(self):
+        keys = [b"%08d" % i for i in range(10000)]
+        with self.db.update() as tx:
+            seq = tx.create_bucket(b"seq")
+            for k in keys:
+                seq.put(k, k)
+            rand = tx.create_bucket(b"rand")
+            for k in reversed(keys):
+                rand.put(k, k)
+
+        with self.db.view() as tx:
+            seq = tx.bucket(b"seq")
+            rand = tx.bucket(b"rand")
+            self.assertLess(self.count_pages(tx, seq), self.count_pages(tx, rand) * 0.8)
+            for k in keys:
+                self.assertEqual(seq.get(k), k)
+
+    def test_fill_percent(self):
+        keys = [b"%08d" % i for i in range(10000)]
+        pages = []
+        for name, fill in [(b"half", 0.5), (b"full", 1.0)]:
+            with self.db.update() as tx:
+                b = tx.create_bucket(name)
+                b.fill_percent = fill
+                for k in reversed(keys):
+                    b.put(k, k)
+            with self.db.view() as tx:
+                b = tx.bucket(name)
+                pages.append(self.count_pages(tx, b))
+                self.assertEqual([k for k, _ in b], keys)
+        self.assertLess(pages[1], pages[0] * 0.6)
+
+    def test_bulk_load(self):
+        keys = [b"%08d" % i for i in range(20000)]
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            b.bulk_load((k, k) for k in keys)
+            b.put(b"00000500x", b"x")
+            b.bulk_load([(b"00000600x", b"y")])
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"widgets")
+            for k in keys[::7]:
+                self.assertEqual(b.get(k), k)
+            self.assertEqual(b.get(b"00000500x"), b"x")
+            self.assertEqual(b.get(b"00000600x"), b"y")
+            self.assertEqual(len(list(b)), len(keys) + 2)
+            data = sum(16 + 2*len(k) for k in keys)
+            self.assertLess(self.count_pages(tx, b), data / self.db.pagesize * 1.2)
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+    def test_bulk_load_root(self):
+        with self.db.update() as tx:
+            tx.bucket().bulk_load([(b"a", b"1"), (b"b", b"*" * 10000), (b"c", b"3")])
+        with self.db.view() as tx:
+            self.assertEqual(list(tx.bucket()), [(b"a", b"1"), (b"b", b"*" * 10000), (b"c", b"3")])
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+    def test_bulk_load_unsorted(self):
+        with self.db.update() as tx:
+            tx.create_bucket(b"widgets")
+        with self.assertRaisesRegex(Exception, "must be sorted"):
+            with self.db.update() as tx:
+                b = tx.bucket(b"widgets")
+                b.bulk_load([(b"%08d" % i, b"*" * 100) for i in range(1000)] + [(b"0", b"")])
+        with self.db.view() as tx:
+            self.assertEqual(list(tx.bucket(b"widgets")), [])
+        # pages past the end allocated by the rolled back tx count once committed
+        with self.db.update():
+            pass
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
     def test_put_incompatible(self):
         with self.db.update() as tx:
             b = tx.create_bucket(b"widgets")
@@ -80,6 +219,166 @@ class TestBucket(unittest.TestCase):
                 self.assertEqual(k, orderd_tyes[i:])
             self.assertEqual(i, len(orderd_tyes)-1)
 
+    def test_reversed(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            self.assertEqual(list(reversed(b)), [])
+            for i in range(0, 5000, 2):
+                b.put(b"%06d" % i, b"%d" % i)
+            b.create_bucket(b"000101")
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"widgets")
+            keys = [k for k, _ in b]
+            self.assertEqual([k for k, _ in reversed(b)], keys[::-1])
+            self.assertEqual(dict(b.reversed())[b"000101"], None)
+
+            self.assertEqual(next(b.reversed(b"000101")), (b"000101", None))
+            self.assertEqual(next(b.reversed(b"000103")), (b"000102", b"102"))
+            self.assertEqual(next(b.reversed(b"zzz")), (b"004998", b"4998"))
+            self.assertEqual(list(b.reversed(b"000001")), [(b"000000", b"0")])
+            self.assertEqual(list(b.reversed(b"")), [])
+
+    def test_range(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            self.assertEqual(list(b.range()), [])
+            for i in range(3000):
+                b.put(b"%04d" % i, b"%d" % i)
+            b.create_bucket(b"0100a")
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"widgets")
+            self.assertEqual(list(b.range()), list(b))
+            self.assertEqual(list(b.range(b"0998", b"1001")),
+                             [(b"0998", b"998"), (b"0999", b"999"), (b"1000", b"1000")])
+            self.assertEqual(list(b.range(b"0100", b"0101")),
+                             [(b"0100", b"100"), (b"0100a", None)])
+            self.assertEqual(list(b.range(b"2999a")), [])
+            self.assertEqual(list(b.range(end=b"0003", keys_only=True)),
+                             [b"0000", b"0001", b"0002"])
+
+            keys = list(b.range(prefix=b"12", keys_only=True))
+            self.assertEqual(keys, [b"%04d" % i for i in range(1200, 1300)])
+            self.assertEqual(list(b.range(b"1250", prefix=b"12", keys_only=True)),
+                             keys[50:])
+            self.assertEqual(list(b.range(b"0000", prefix=b"12", keys_only=True)), keys)
+            self.assertEqual(list(b.range(prefix=b"4")), [])
+
+            self.assertEqual(list(b.range(b"0500", limit=3, keys_only=True)),
+                             [b"0500", b"0501", b"0502"])
+            self.assertEqual(list(b.range(limit=0)), [])
+
+    def test_seek_finger(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(0, 20000, 2):
+                b.put(b"%05d" % i, b"x")
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"widgets")
+            c = b.cursor()
+            random.seed(0)
+            for _ in range(500):
+                key = b"%05d" % random.randrange(20001)
+                self.assertEqual(c.seek(key), b.cursor().seek(key))
+
+            c.seek(b"10000")
+            depth = len(c.stack)
+            self.assertGreater(depth, 1)
+            leaf = c.stack[-1]
+            page_node = b.page_node
+            calls = []
+            b.page_node = lambda pgid: calls.append(pgid) or page_node(pgid)
+            self.assertEqual(c.seek(b"10003"), (b"10004", b"x"))
+            self.assertIs(c.stack[-1], leaf)
+            self.assertEqual(calls, [])
+            del b.page_node
+
+        with self.db.update() as tx:
+            b = tx.bucket(b"widgets")
+            c = b.cursor()
+            c.seek(b"10000")
+            b.put(b"10001", b"y")
+            self.assertEqual(c.seek(b"10001"), (b"10001", b"y"))
+
+    def test_node_keys(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(2000):
+                b.put(b"%04d" % i, b"x" * 100)
+
+        random.seed(1)
+        with self.db.update() as tx:
+            b = tx.bucket(b"widgets")
+            for i in random.sample(range(3000), 1500):
+                if i % 3:
+                    b.put(b"%04d" % i, b"y")
+                else:
+                    b.delete(b"%04d" % i)
+            for n in b.nodes.values():
+                self.assertEqual(n.keys, [i.key for i in n.inodes])
+                self.assertEqual(n.payload, sum(len(i.key) + len(i.value) for i in n.inodes))
+            expected = [k for k, _ in b]
+
+        with self.db.view() as tx:
+            self.assertEqual([k for k, _ in tx.bucket(b"widgets")], expected)
+
+    def test_bulk_load_emptied_first_leaf(self):
+        keys = [b"%04d" % i for i in range(300)]
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for k in keys:
+                b.put(k, b"*" * 100)
+
+        with self.db.update() as tx:
+            b = tx.bucket(b"widgets")
+            for k in keys[:60]:
+                b.delete(k)
+            # not empty, so this must fall back to put()
+            b.bulk_load([(b"a", b"1"), (b"b", b"2")])
+
+        with self.db.view() as tx:
+            self.assertEqual([k for k, _ in tx.bucket(b"widgets")],
+                             keys[60:] + [b"a", b"b"])
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+    def test_iter_emptied_leaves(self):
+        keys = [b"%04d" % i for i in range(300)]
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for k in keys:
+                b.put(k, b"*" * 100)
+
+        with self.db.update() as tx:
+            b = tx.bucket(b"widgets")
+            # empty the first and the last leaf, they stay until commit
+            for k in keys[:60] + keys[-60:]:
+                b.delete(k)
+            live = keys[60:-60]
+            self.assertEqual(b.cursor().first()[0], live[0])
+            self.assertEqual(b.cursor().last()[0], live[-1])
+            self.assertEqual([k for k, _ in b], live)
+            self.assertEqual([k for k, _ in reversed(b)], live[::-1])
+
+    def test_cursor_prev(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(1000):
+                b.put(b"%04d" % i, b"x")
+
+        with self.db.view() as tx:
+            c = tx.bucket(b"widgets").cursor()
+            self.assertEqual(c.seek(b"0500")[0], b"0500")
+            self.assertEqual(c.prev()[0], b"0499")
+            self.assertEqual(c.next()[0], b"0500")
+            self.assertEqual(c.seek_le(b"0700a")[0], b"0700")
+            self.assertEqual(c.seek_le(b"0")[0], None)
+            self.assertEqual(c.first()[0], b"0000")
+            self.assertEqual(c.prev(), (None, None))
+            self.assertEqual(c.last()[0], b"0999")
+            self.assertEqual(c.prev()[0], b"0998")
+
     def test_delete(self):
         with self.db.update() as tx:
             b = tx.create_bucket(b"widgets")
@@ -106,6 +405,75 @@ class TestBucket(unittest.TestCase):
                 v = b.get(str(i).encode())
                 self.assertIsNone(v)
 
+    def test_delete_merge(self):
+        keys = [b"%08d" % i for i in range(10000)]
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for k in keys:
+                b.put(k, k)
+        with self.db.view() as tx:
+            before = self.count_pages(tx, tx.bucket(b"widgets"))
+
+        with self.db.update() as tx:
+            b = tx.bucket(b"widgets")
+            for i, k in enumerate(keys):
+                if i % 10:
+                    b.delete(k)
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"widgets")
+            after = self.count_pages(tx, b)
+            self.assertLess(after, before / 4)
+            self.assertEqual([k for k, _ in b], keys[::10])
+        # every page that left the tree went to the freelist
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+    def test_delete_single_child_parent(self):
+        # packed append-only leaves left a branch with a single child
+        keys = [b"%08d" % i for i in range(1196)]
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for k in keys:
+                b.put(k, b"*" * 500)
+
+        with self.db.update() as tx:
+            b = tx.bucket(b"widgets")
+            for k in keys[1191:]:
+                b.delete(k)
+
+        with self.db.view() as tx:
+            self.assertEqual([k for k, _ in tx.bucket(b"widgets")], keys[:1191])
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+    def test_split_min_keys(self):
+        # a full-page split of an append-only leaf leaves both halves 2 keys or more
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(8):
+                b.put(b"%08d" % i, b"*" * 500)
+            n = b.root_node
+            _, next = n.split_two(self.db.pagesize)
+            self.assertGreaterEqual(len(next.inodes), 2)
+            self.assertEqual(len(n.inodes) + len(next.inodes), 8)
+
+    def test_delete_collapse_root(self):
+        keys = [b"%08d" % i for i in range(10000)]
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for k in keys:
+                b.put(k, k)
+
+        with self.db.update() as tx:
+            b = tx.bucket(b"widgets")
+            for k in keys[1:]:
+                b.delete(k)
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"widgets")
+            self.assertEqual(self.count_pages(tx, b), 1)
+            self.assertEqual(list(b), [(keys[0], keys[0])])
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
     def test_delete_nonexisting(self):
         with self.db.update() as tx:
             b = tx.create_bucket(b"widgets")
@@ -185,6 +553,26 @@ class TestBucket(unittest.TestCase):
             widgets = tx.create_bucket(b"widgets")
             self.assertIsNone(widgets.bucket(b"foo"))
 
+    def test_delete_bucket_free_pages(self):
+        with self.db.update() as tx:
+            widgets = tx.create_bucket(b"widgets")
+            for i in range(1000):
+                k = str(i).encode()
+                widgets.put(k, k)
+            foo = widgets.create_bucket(b"foo")
+            for i in range(1000):
+                foo.put(str(i).encode(), b"*" * 100)
+            foo.create_bucket(b"inline").put(b"a", b"b")
+            foo.create_bucket(b"bar").put(b"big", b"*" * 10000)
+
+        with self.db.update() as tx:
+            tx.bucket(b"widgets").bucket(b"foo").put(b"new", b"new")
+            tx.delete_bucket(b"widgets")
+
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+        with self.db.view() as tx:
+            self.assertEqual(list(tx.bucket()), [])
+
     def test_create_bucket_incompatible(self):
         with self.db.update() as tx:
             widgets = tx.create_bucket(b"widgets")
@@ -0,0 +1,77 @@
+import os
+import unittest
+import tempfile
+
+from boltdb import BoltDB
+from boltdb.cache import PageCache
+from boltdb.page import Page
+
+
+def page(pgid):
+    p = Page()
+    p.id = pgid
+    return p
+
+
+class TestPageCache(unittest.TestCase):
+
+    def test_lru_pages(self):
+        c = PageCache(max_pages=2)
+        c.put(page(3), 10)
+        c.put(page(4), 10)
+        self.assertIsNotNone(c.get(3))
+        c.put(page(5), 10)
+        self.assertIsNone(c.get(4))
+        self.assertIsNotNone(c.get(3))
+        self.assertIsNotNone(c.get(5))
+
+    def test_lru_bytes(self):
+        c = PageCache(max_pages=100, max_bytes=25)
+        c.put(page(3), 10)
+        c.put(page(4), 10)
+        c.put(page(5), 10)
+        self.assertEqual(len(c), 2)
+        self.assertEqual(c.nbytes, 20)
+        self.assertIsNone(c.get(3))
+
+
+class TestDBPageCache(unittest.TestCase):
+
+    def setUp(self):
+        self.db = BoltDB(tempfile.mktemp())
+
+    def tearDown(self):
+        os.unlink(self.db.filename)
+
+    def test_cross_tx(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(1000):
+                k = str(i).encode()
+                b.put(k, k)
+
+        with self.db.view() as tx:
+            self.assertEqual(tx.bucket(b"widgets").get(b"10"), b"10")
+        cached = len(self.db.page_cache)
+        self.assertGreater(cached, 0)
+
+        with self.db.view() as tx:
+            root = tx.bucket(b"widgets").root_pgid
+            self.assertTrue(tx.page(root).is_branch())
+            self.assertIs(tx.page(root), self.db.page_cache.get(root))
+            # leaves are read straight from the mmap, never cached
+            leaf = tx.page(root).branch_pgid(0)
+            self.assertIsNone(self.db.page_cache.get(leaf))
+            self.assertIsNone(tx.page(leaf).inodes)
+
+    def test_invalidate_on_reuse(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(1000):
+                b.put(b"%04d" % i, b"")
+        for i in range(20):
+            # each commit rewrites the cached branch root onto a reused page
+            with self.db.update() as tx:
+                tx.bucket(b"widgets").put(b"foo", str(i).encode())
+            with self.db.view() as tx:
+                self.assertEqual(tx.bucket(b"widgets").get(b"foo"), str(i).encode())
@@ -0,0 +1,141 @@
+import io
+import os
+import unittest
+import tempfile
+
+from boltdb import BoltDB, compact
+from boltdb.codec import CODEC_ZLIB, register_codec, codecs, names
+from boltdb.share import compressedValueFlag
+
+
+def doc(i):
+    return b'{"id": %d, "name": "widget", "tags": ["a", "b", "c"], "pad": "%s"}' % (i, b"x" * 200)
+
+
+class TestCodec(unittest.TestCase):
+
+    def setUp(self):
+        self.db = BoltDB(tempfile.mktemp())
+
+    def tearDown(self):
+        self.db.close()
+        os.unlink(self.db.filename)
+
+    def stored(self, b, key):
+        # the value and flags as they are on the page
+        _, v, flags = b.cursor()._seek(key)
+        return v, flags
+
+    def test_put_get(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"docs", codec="zlib", threshold=100)
+            b.put(b"small", b"x" * 50)
+            b.put(b"random", os.urandom(500))
+            for i in range(1000):
+                b.put(b"%04d" % i, doc(i))
+
+            v, flags = self.stored(b, b"0001")
+            self.assertTrue(flags & compressedValueFlag)
+            self.assertLess(len(v), len(doc(1)))
+            self.assertEqual(self.stored(b, b"small")[1], 0)
+            # incompressible values are kept as they are
+            self.assertEqual(self.stored(b, b"random")[1], 0)
+            self.assertEqual(b.get(b"0001"), doc(1))
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"docs")
+            self.assertEqual(b.codec, CODEC_ZLIB)
+            self.assertEqual(b.threshold, 100)
+            self.assertEqual(b.get(b"0500"), doc(500))
+            self.assertEqual(b.get(b"small"), b"x" * 50)
+            self.assertEqual(b.get_many([b"0002", b"0003"]), [doc(2), doc(3)])
+            values = [v for _, v in b.range(end=b"1000")]
+            self.assertEqual(values, [doc(i) for i in range(1000)])
+            self.assertEqual(next(reversed(b)), (b"small", b"x" * 50))
+            self.assertEqual(b.cursor().seek(b"0999"), (b"0999", doc(999)))
+            self.assertEqual(b.open_blob(b"0007").read(), doc(7))
+
+    def test_smaller(self):
+        with self.db.update() as tx:
+            plain = tx.create_bucket(b"plain")
+            packed = tx.create_bucket(b"packed", codec="zlib")
+            for i in range(1000):
+                plain.put(b"%04d" % i, doc(i))
+                packed.put(b"%04d" % i, doc(i))
+
+        pages = {}
+        with self.db.view() as tx:
+            for name in (b"plain", b"packed"):
+                reachable = {}
+                tx.check_bucket(tx.bucket(name), reachable)
+                pages[name] = len(reachable)
+        self.assertLess(pages[b"packed"] * 2, pages[b"plain"])
+
+    def test_reopen(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"docs", codec="zlib")
+            b.put(b"one", doc(1))
+            b.create_bucket(b"sub", codec="lzma").put(b"two", doc(2))
+            b.bulk_load([])
+            tx.create_bucket(b"plain").put(b"three", doc(3))
+
+        self.db.close()
+        self.db = BoltDB(self.db.filename)
+        with self.db.view() as tx:
+            b = tx.bucket(b"docs")
+            self.assertEqual(b.get(b"one"), doc(1))
+            self.assertEqual(b.bucket(b"sub").get(b"two"), doc(2))
+            self.assertEqual(self.stored(b.bucket(b"sub"), b"two")[1], compressedValueFlag)
+            self.assertEqual(tx.bucket(b"plain").get(b"three"), doc(3))
+            self.assertEqual(tx.bucket(b"plain").codec, 0)
+
+    def test_bulk_load_and_stream(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"docs", codec="zlib")
+            b.bulk_load((b"%04d" % i, doc(i)) for i in range(500))
+            b.put_stream(b"stream", io.BytesIO(doc(9)))
+            b.put_many([(b"many", doc(8))])
+            self.assertEqual(self.stored(b, b"stream")[1], 0)
+
+        with self.db.view() as tx:
+            b = tx.bucket(b"docs")
+            self.assertEqual([v for _, v in b.range(end=b"0500")],
+                             [doc(i) for i in range(500)])
+            self.assertEqual(b.get(b"stream"), doc(9))
+            self.assertEqual(b.get(b"many"), doc(8))
+
+    def test_register_codec(self):
+        register_codec(100, "reverse", lambda v: bytes(v)[::-1][:-1], lambda v: b"x" + bytes(v)[::-1])
+        try:
+            with self.assertRaisesRegex(Exception, "already registered"):
+                register_codec(100, "other", None, None)
+            with self.db.update() as tx:
+                b = tx.create_bucket(b"docs", codec="reverse", threshold=1)
+                b.put(b"k", b"xabc")
+                self.assertEqual(self.stored(b, b"k"), (b"cba", compressedValueFlag))
+                self.assertEqual(b.get(b"k"), b"xabc")
+                with self.assertRaisesRegex(Exception, "unknown codec"):
+                    tx.create_bucket(b"bad", codec="nope")
+        finally:
+            del codecs[100]
+            del names["reverse"]
+
+    def test_compact(self):
+        dst = tempfile.mktemp()
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"docs", codec="zlib", threshold=10)
+            for i in range(100):
+                b.put(b"%04d" % i, doc(i))
+        self.db.close()
+        try:
+            compact(self.db.filename, dst)
+            db = BoltDB(dst)
+            with db.view() as tx:
+                b = tx.bucket(b"docs")
+                self.assertEqual((b.codec, b.threshold), (CODEC_ZLIB, 10))
+                self.assertEqual(self.stored(b, b"0001")[1], compressedValueFlag)
+                self.assertEqual(b.get(b"0050"), doc(50))
+            db.close()
+        finally:
+            os.unlink(dst)
+        self.db = BoltDB(self.db.filename)
@@ -0,0 +1,143 @@
+import os
+import unittest
+import tempfile
+
+from boltdb import BoltDB, compact
+from boltdb.bucket import Bucket
+
+
+def walk(bucket, path=()):
+    """yield (path, key, value) for every entry, value is None for buckets"""
+    c = bucket.cursor()
+    k, v = c.first()
+    while k is not None:
+        yield path, k, v
+        if v is None:
+            yield from walk(bucket.bucket(k), path + (k,))
+        k, v = c.next()
+
+
+class TestCompact(unittest.TestCase):
+
+    def setUp(self):
+        self.src = tempfile.mktemp()
+        self.dst = tempfile.mktemp()
+
+    def tearDown(self):
+        for f in (self.src, self.dst):
+            if os.path.exists(f):
+                os.unlink(f)
+
+    def dump(self, filename):
+        db = BoltDB(filename)
+        try:
+            with db.view() as tx:
+                return list(walk(tx.root))
+        finally:
+            db.close()
+
+    def test_compact(self):
+        db = BoltDB(self.src)
+        with db.update() as tx:
+            tx.bucket().put(b"root", b"value")
+            widgets = tx.create_bucket(b"widgets")
+            for i in range(5000):
+                widgets.put(b"%06d" % i, b"*" * 100)
+            widgets.create_bucket(b"inline").put(b"a", b"b")
+            nested = widgets.create_bucket(b"nested")
+            for i in range(2000):
+                nested.put(b"%06d" % i, b"x" * 50)
+            tx.create_bucket(b"empty")
+            tx.create_bucket(b"churn")
+        for n in range(5):
+            with db.update() as tx:
+                churn = tx.bucket(b"churn")
+                for i in range(2000):
+                    churn.put(b"%06d" % i, b"%d" % n * 200)
+        with db.update() as tx:
+            churn = tx.bucket(b"churn")
+            for i in range(2000):
+                if i % 50:
+                    churn.delete(b"%06d" % i)
+        db.close()
+
+        src_size, dst_size = compact(self.src, self.dst, tx_max_size=10000)
+        self.assertEqual(src_size, os.path.getsize(self.src))
+        self.assertEqual(dst_size, os.path.getsize(self.dst))
+        self.assertLess(dst_size, src_size / 2)
+        self.assertEqual(self.dump(self.dst), self.dump(self.src))
+
+        db = BoltDB(self.dst)
+        with db.update() as tx:
+            tx.bucket(b"widgets").put(b"new", b"new")
+        with db.view() as tx:
+            self.assertEqual(tx.bucket(b"widgets").get(b"new"), b"new")
+            self.assertEqual(tx.bucket(b"widgets").bucket(b"inline").root_pgid, 0)
+        db.close()
+
+    def test_compact_bulk_loads(self):
+        db = BoltDB(self.src)
+        with db.update() as tx:
+            b = tx.create_bucket(b"widgets", codec="zlib")
+            for i in range(3000):
+                b.put(b"%06d" % i, b"*" * 100)
+            b.create_bucket(b"nested").put(b"a", b"b")
+        db.close()
+
+        loaded = []
+        bulk_load = Bucket.bulk_load
+
+        def spy(b, items):
+            items = list(items)
+            loaded.append(len(items))
+            return bulk_load(b, items)
+
+        Bucket.bulk_load = spy
+        try:
+            compact(self.src, self.dst)
+        finally:
+            Bucket.bulk_load = bulk_load
+        # root and widgets, the inline nested bucket is put
+        self.assertEqual(sorted(loaded), [0, 3000])
+        self.assertEqual(self.dump(self.dst), self.dump(self.src))
+
+        db = BoltDB(self.dst)
+        # leftovers of the leaf runs went back to the end of the file
+        self.assertLess(len(db.freelist.ids), 10)
+        with db.view() as tx:
+            self.assertEqual(tx.bucket(b"widgets").codec, 1)
+        db.close()
+
+    def test_compact_small_buckets(self):
+        db = BoltDB(self.src)
+        with db.update() as tx:
+            for i in range(200):
+                b = tx.create_bucket(b"b%04d" % i)
+                for j in range(5):
+                    b.put(b"k%d" % j, b"v" * 20)
+        db.close()
+
+        src_size, dst_size = compact(self.src, self.dst)
+        self.assertLessEqual(dst_size, src_size)
+        self.assertEqual(self.dump(self.dst), self.dump(self.src))
+
+        db = BoltDB(self.dst)
+        self.assertLess(len(db.freelist.ids), 10)
+        with db.view() as tx:
+            self.assertEqual(tx.bucket(b"b0100").root_pgid, 0)
+        db.close()
+
+    def test_compact_existing_dst(self):
+        for f in (self.src, self.dst):
+            db = BoltDB(f)
+            with db.update() as tx:
+                tx.bucket().put(os.path.basename(f).encode(), b"v")
+            db.close()
+        with self.assertRaisesRegex(Exception, "destination already exists"):
+            compact(self.src, self.dst)
+        self.assertEqual(len(self.dump(self.dst)), 1)
+
+        # an empty file is fine
+        open(self.dst, "w").close()
+        compact(self.src, self.dst)
+        self.assertEqual(self.dump(self.dst), self.dump(self.src))
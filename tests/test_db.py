@@ -0,0 +1,61 @@
+import os
+import unittest
+import tempfile
+
+from boltdb import BoltDB
+
+
+class TestDB(unittest.TestCase):
+
+    def setUp(self):
+        self.db = BoltDB(tempfile.mktemp())
+
+    def tearDown(self):
+        os.unlink(self.db.filename)
+
+    def test_mmap_size(self):
+        self.assertEqual(self.db.mmap_size(0), 1 << 15)
+        self.assertEqual(self.db.mmap_size(1 << 15), 1 << 15)
+        self.assertEqual(self.db.mmap_size((1 << 15) + 1), 1 << 16)
+        self.assertEqual(self.db.mmap_size((1 << 30) - 1), 1 << 30)
+        self.assertEqual(self.db.mmap_size((1 << 30) + 1), 1 << 31)
+        self.db.max_grow_step = 1 << 20
+        self.assertEqual(self.db.mmap_size(5 << 19), 3 << 20)
+
+    def test_grow_geometric(self):
+        grows = []
+        grow = self.db.grow
+
+        def record(size):
+            grows.append(size)
+            grow(size)
+
+        self.db.grow = record
+        with self.db.update() as tx:
+            b = tx.bucket()
+            for i in range(1000):
+                b.put(str(i).encode(), b"*" * 4000)
+        self.assertLess(len(grows), 10)
+        self.assertEqual(self.db.datasz & (self.db.datasz - 1), 0)
+
+        with self.db.view() as tx:
+            self.assertEqual(tx.bucket().get(b"999"), b"*" * 4000)
+
+    def test_initial_mmap_size(self):
+        db = BoltDB(tempfile.mktemp(), initial_mmap_size=1 << 20)
+        self.addCleanup(os.unlink, db.filename)
+        self.assertEqual(db.datasz, 1 << 20)
+        self.assertEqual(db.max_pgid, 4)
+        grows = []
+        db.grow = grows.append
+        with db.update() as tx:
+            for i in range(100):
+                tx.bucket().put(str(i).encode(), b"*" * 1000)
+        self.assertEqual(grows, [])
+        db.close()
+
+        db = BoltDB(db.filename)
+        self.assertEqual(db.datasz, 1 << 20)
+        with db.view() as tx:
+            self.assertEqual(tx.bucket().get(b"99"), b"*" * 1000)
+        db.close()
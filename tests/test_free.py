@@ -1,8 +1,19 @@
 import os
+import threading
 import unittest
 import tempfile
 
 from boltdb import BoltDB
+from boltdb.freelist import FreeList
+from boltdb.page import Page, page_from_data
+from boltdb.share import NO_FREELIST
+
+
+def page(pgid, overflow=0):
+    p = Page()
+    p.id = pgid
+    p.overflow = overflow
+    return p
 
 
 class TestFree(unittest.TestCase):
@@ -14,18 +25,19 @@ class TestFree(unittest.TestCase):
         os.unlink(self.db.filename)
 
     def test_free(self):
+        # the old root and the old freelist page are freed on each commit
         with self.db.update() as tx:
             b = tx.bucket()
             b.put(b"foo", b"bar")
-        self.assertEqual(self.db.freelist.ids, [3])
+        self.assertEqual(self.db.freelist.ids, [2, 3])
 
         with self.db.update() as tx:
             b = tx.bucket()
             b.put(b"foo", b"bar")
-        self.assertEqual(self.db.freelist.ids, [4])
+        self.assertEqual(self.db.freelist.ids, [4, 5])
 
     def test_free2(self):
-        self.assertEqual(self.db.freepages(), [2])
+        self.assertEqual(self.db.freepages(), [])
 
         with self.db.update() as tx:
             b = tx.bucket()
@@ -35,4 +47,233 @@ class TestFree(unittest.TestCase):
         with self.db.update() as tx:
             b = tx.bucket()
             b.put(b"foo", b"bar")
-        self.assertEqual(sorted(self.db.freepages()), [2, 4])
+        self.assertEqual(sorted(self.db.freepages()), [4, 5])
+
+    def test_freepages_nested(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(1000):
+                k = str(i).encode()
+                b.put(k, k)
+            b.create_bucket(b"foo")
+        with self.db.update() as tx:
+            for i in range(500):
+                tx.bucket(b"widgets").put(str(i).encode(), b"x")
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+    def test_reopen(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(2000):
+                b.put(str(i).encode(), b"*" * 1000)
+        with self.db.update() as tx:
+            b = tx.bucket(b"widgets")
+            for i in range(2000):
+                b.put(str(i).encode(), b"x")
+        ids = self.db.freelist.ids
+        # spans more than one page
+        self.assertGreater(len(ids), self.db.pagesize // 8)
+        self.db.close()
+
+        self.db = BoltDB(self.db.filename)
+        self.assertEqual(self.db.freelist.ids, ids)
+
+    def test_no_freelist_sync(self):
+        self.db.close()
+        self.db = BoltDB(self.db.filename, freelist_sync=False)
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(1000):
+                k = str(i).encode()
+                b.put(k, k)
+        with self.db.update() as tx:
+            for i in range(500):
+                tx.bucket(b"widgets").put(str(i).encode(), b"x")
+        ids = self.db.freelist.ids
+        self.db.close()
+
+        self.db = BoltDB(self.db.filename, freelist_sync=False)
+        self.db.freelist_loader.join()
+        self.assertEqual(self.db.freelist.ids, ids)
+        with self.db.view() as tx:
+            self.assertEqual(tx.bucket(b"widgets").get(b"999"), b"999")
+
+    def test_close_without_commit(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"x")
+            for i in range(2000):
+                b.put(b"%06d" % i, b"*" * 100)
+
+        tx = self.db.begin(True)
+        tx.delete_bucket(b"x")
+        tx.close()
+
+        with self.db.update() as tx:
+            tx.create_bucket(b"y").put(b"a", b"b")
+        with self.db.view() as tx:
+            self.assertEqual(len(list(tx.bucket(b"x"))), 2000)
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+    def write_no_freelist(self):
+        self.db.close()
+        self.db = BoltDB(self.db.filename, freelist_sync=False)
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(1000):
+                b.put(str(i).encode(), b"*" * 100)
+        with self.db.update() as tx:
+            for i in range(1000):
+                tx.bucket(b"widgets").put(str(i).encode(), b"x")
+        self.db.close()
+
+    def test_commit_during_freelist_scan(self):
+        self.write_no_freelist()
+        gate = threading.Event()
+        freepages = BoltDB.freepages
+
+        def slow(db, tx=None):
+            gate.wait()
+            return freepages(db, tx)
+
+        BoltDB.freepages = slow
+        try:
+            self.db = BoltDB(self.db.filename)
+            with self.db.update() as tx:
+                for i in range(1000):
+                    tx.bucket(b"widgets").put(str(i).encode(), b"y")
+            # the freelist isn't complete yet, so it isn't written
+            self.assertEqual(self.db.meta().freelist, NO_FREELIST)
+            gate.set()
+            self.db.freelist_loader.join()
+        finally:
+            BoltDB.freepages = freepages
+
+        # pages freed by the commit above are not also found by the scan
+        f = self.db.freelist
+        self.assertEqual(len(set(f.ids)), f.free_count())
+        self.assertEqual(len(f.ids), f.free_count())
+
+        with self.db.update() as tx:
+            tx.bucket(b"widgets").put(b"b", b"b")
+        self.assertNotEqual(self.db.meta().freelist, NO_FREELIST)
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+        self.db.close()
+        self.db = BoltDB(self.db.filename)
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+    def test_freelist_scan_error(self):
+        self.write_no_freelist()
+        freepages = BoltDB.freepages
+
+        def fail(db, tx=None):
+            raise ValueError("bad page")
+
+        BoltDB.freepages = fail
+        try:
+            self.db = BoltDB(self.db.filename)
+            self.db.freelist_loader.join()
+        finally:
+            BoltDB.freepages = freepages
+        with self.db.update() as tx:
+            tx.bucket(b"widgets").put(b"a", b"a")
+        self.assertEqual(self.db.meta().freelist, NO_FREELIST)
+        with self.assertRaisesRegex(Exception, "freelist scan failed"):
+            self.db.close()
+        self.db = BoltDB(self.db.filename)
+        self.db.freelist_loader.join()
+        self.assertEqual(sorted(self.db.freepages()), self.db.freelist.ids)
+
+
+class TestFreeList(unittest.TestCase):
+
+    def test_allocate(self):
+        f = FreeList()
+        f.read_ids([3, 4, 5, 6, 7, 9, 12, 13, 18])
+        self.assertEqual(f.allocate(3), 3)
+        self.assertEqual(f.allocate(1) in (9, 18), True)
+        self.assertEqual(f.allocate(2), 12)
+        self.assertEqual(f.allocate(3), 0)
+        self.assertEqual(f.allocate(2), 6)
+        self.assertEqual(f.free_count(), 1)
+        self.assertEqual(len(f.ids), 1)
+
+    def test_merge(self):
+        f = FreeList()
+        f.read_ids([3, 7])
+        f.free(100, page(4, overflow=2))
+        self.assertEqual(f.allocate(5), 0)
+        f.release(100)
+        self.assertEqual(f.ids, [3, 4, 5, 6, 7])
+        self.assertEqual(f.forward, {3: 5})
+        self.assertEqual(f.allocate(5), 3)
+        self.assertEqual(f.ids, [])
+
+    def test_rollback(self):
+        f = FreeList()
+        f.read_ids([3, 4, 5])
+        self.assertEqual(f.allocate(2), 3)
+        f.free(100, page(8))
+        f.rollback(100)
+        self.assertEqual(f.ids, [3, 4, 5])
+        self.assertNotIn(8, f.cache)
+
+    def test_double_free(self):
+        f = FreeList()
+        f.read_ids([3])
+        with self.assertRaisesRegex(Exception, "page already freed"):
+            f.free(100, page(3))
+
+    def test_release(self):
+        f = FreeList()
+        f.free(100, page(3))
+        f.free(101, page(4))
+        f.free(102, page(5))
+        f.release(101)
+        self.assertEqual(f.ids, [3, 4])
+        self.assertEqual(f.pending, {102: [5]})
+
+        p = page_from_data(memoryview(bytearray(4096)))
+        f.write(p)
+        self.assertEqual(p.free_ids(), [3, 4, 5])
+        self.assertEqual(f.pending_count(), 1)
+
+    def test_write_merges_pending(self):
+        f = FreeList()
+        f.read_ids([3, 4, 9, 10, 11, 20])
+        f.free(100, page(15))
+        f.free(100, page(6, overflow=1))
+        f.free(101, page(12))
+        f.free(101, page(2))
+
+        p = page_from_data(memoryview(bytearray(4096)))
+        f.write(p)
+        self.assertEqual(p.free_ids(), [2, 3, 4, 6, 7, 9, 10, 11, 12, 15, 20])
+        self.assertEqual(p.count, f.count())
+
+    def test_write_overflow(self):
+        ids = list(range(2, 0x10010))
+        p = page_from_data(memoryview(bytearray(16 + 8 * (len(ids)+1))))
+        p.write_ids(ids)
+        self.assertEqual(p.count, 0xffff)
+        self.assertEqual(p.free_ids(), ids)
+
+    def test_reader_holds_pages(self):
+        db = BoltDB(tempfile.mktemp())
+        self.addCleanup(os.unlink, db.filename)
+        with db.update() as tx:
+            tx.bucket().put(b"foo", b"bar")
+
+        rtx = db.begin()
+        root = rtx.meta.root_pgid
+        with db.update() as tx:
+            tx.bucket().put(b"foo", b"baz")
+        self.assertNotIn(root, db.freelist.ids)
+        with db.update() as tx:
+            tx.bucket().put(b"foo", b"bat")
+        self.assertNotIn(root, db.freelist.ids)
+        self.assertEqual(rtx.bucket().get(b"foo"), b"bar")
+
+        rtx.close()
+        with db.update() as tx:
+            pass
+        self.assertIn(root, db.freelist.ids)
@@ -0,0 +1,74 @@
+import os
+import unittest
+import tempfile
+
+from boltdb import BoltDB, merge, intersect, anti_join
+
+
+class TestJoin(unittest.TestCase):
+
+    def setUp(self):
+        self.db = BoltDB(tempfile.mktemp())
+        with self.db.update() as tx:
+            for name, step in ((b"two", 2), (b"three", 3), (b"five", 5)):
+                b = tx.create_bucket(name)
+                for i in range(0, 3000, step):
+                    b.put(b"%04d" % i, name)
+
+    def tearDown(self):
+        self.db.close()
+        os.unlink(self.db.filename)
+
+    def test_merge(self):
+        with self.db.view() as tx:
+            two, three = tx.bucket(b"two"), tx.bucket(b"three")
+            got = list(merge(two, three))
+            keys = sorted({i for i in range(0, 3000) if i % 2 == 0 or i % 3 == 0})
+            self.assertEqual([k for k, _ in got], [b"%04d" % i for i in keys])
+            self.assertEqual(dict(got)[b"0004"], [b"two", None])
+            self.assertEqual(dict(got)[b"0009"], [None, b"three"])
+            self.assertEqual(dict(got)[b"0006"], [b"two", b"three"])
+
+    def test_intersect(self):
+        with self.db.view() as tx:
+            buckets = [tx.bucket(n) for n in (b"two", b"three", b"five")]
+            got = list(intersect(*buckets))
+            self.assertEqual([k for k, _ in got],
+                             [b"%04d" % i for i in range(0, 3000, 30)])
+            self.assertEqual(got[0][1], [b"two", b"three", b"five"])
+
+        with self.db.update() as tx:
+            empty = tx.create_bucket(b"empty")
+            self.assertEqual(list(intersect(tx.bucket(b"two"), empty)), [])
+
+    def test_anti_join(self):
+        with self.db.view() as tx:
+            two, three, five = (tx.bucket(n) for n in (b"two", b"three", b"five"))
+            got = list(anti_join(two, three, five))
+            self.assertEqual([k for k, _ in got],
+                             [b"%04d" % i for i in range(0, 3000, 2)
+                              if i % 3 and i % 5])
+            self.assertEqual(list(anti_join(two)), list(two))
+
+    def test_write_tx_emptied_first_leaf(self):
+        keys = [b"%04d" % i for i in range(300)]
+        with self.db.update() as tx:
+            x, y = tx.create_bucket(b"x"), tx.create_bucket(b"y")
+            for k in keys:
+                x.put(k, b"x" * 100)
+                y.put(k, b"y")
+
+        with self.db.update() as tx:
+            x, y = tx.bucket(b"x"), tx.bucket(b"y")
+            for k in keys[:60]:
+                x.delete(k)
+            self.assertEqual([k for k, _ in intersect(x, y)], keys[60:])
+            merged = dict(merge(x, y))
+            self.assertEqual(merged[keys[0]], [None, b"y"])
+            self.assertEqual(merged[keys[100]], [b"x" * 100, b"y"])
+            self.assertEqual([k for k, _ in anti_join(y, x)], keys[:60])
+
+    def test_same_tx(self):
+        with self.db.view() as tx1, self.db.view() as tx2:
+            with self.assertRaisesRegex(Exception, "same tx"):
+                list(intersect(tx1.bucket(b"two"), tx2.bucket(b"two")))
@@ -0,0 +1,74 @@
+import os
+import random
+import unittest
+
+from boltdb.node import Inode
+from boltdb.page import page_from_data
+from boltdb.share import leaf_elem_struct, branch_elem_struct, \
+    leafPageFlag, branchPageFlag
+
+
+def encode(flags, inodes, size):
+    # the element by element encoding write_inodes used to do
+    data = bytearray(size)
+    elem_size = leaf_elem_struct.size if flags == leafPageFlag else branch_elem_struct.size
+    off = 16 + elem_size * len(inodes)
+    for i, n in enumerate(inodes):
+        pos = 16 + i * elem_size
+        if flags == leafPageFlag:
+            b = leaf_elem_struct.pack(n.flags, off-pos, len(n.key), len(n.value))
+        else:
+            b = branch_elem_struct.pack(off-pos, len(n.key), n.pgid)
+        data[pos:pos+len(b)] = b
+        data[off:off+len(n.key)] = n.key
+        data[off+len(n.key):off+len(n.key)+len(n.value)] = n.value
+        off += len(n.key) + len(n.value)
+    return bytes(data[16:])
+
+
+class TestPage(unittest.TestCase):
+
+    def setUp(self):
+        random.seed(0)
+
+    def write(self, flags, inodes, size=1 << 16):
+        buf = bytearray(size)
+        p = page_from_data(memoryview(buf))
+        p.id = 7
+        p.flags = flags
+        p.write_inodes(inodes)
+        return p, bytes(buf[16:])
+
+    def test_write_leaf(self):
+        inodes = []
+        for i in range(300):
+            key = b"%06d" % i + os.urandom(random.randrange(5))
+            inodes.append(Inode(key, os.urandom(random.randrange(100)), 0, i % 2))
+        p, data = self.write(leafPageFlag, inodes)
+        self.assertEqual(data, encode(leafPageFlag, inodes, 1 << 16))
+        self.assertEqual(p.count, 300)
+        self.assertEqual(p.leaf_elem(17), (inodes[17].key, inodes[17].value, 1))
+
+    def test_write_branch(self):
+        # "IIQ" repeated keeps native alignment, every pgid lands on 8 bytes
+        inodes = [Inode(b"%06d" % i + b"k" * random.randrange(7), b"",
+                        random.randrange(1 << 40), 0) for i in range(300)]
+        p, data = self.write(branchPageFlag, inodes)
+        self.assertEqual(data, encode(branchPageFlag, inodes, 1 << 16))
+        self.assertEqual(p.branch_pgid(123), inodes[123].pgid)
+        self.assertEqual(p.elem_key(299), inodes[299].key)
+
+    def test_ids(self):
+        for n in (0, 5, 0xfffe, 0xffff, 0x10005):
+            ids = sorted(random.sample(range(2, 1 << 48), n))
+            buf = bytearray(16 + 8 * (n + 1))
+            p = page_from_data(memoryview(buf))
+            p.write_ids(ids)
+            # little-endian on disk whatever the host order
+            start = 1 if n >= 0xffff else 0
+            for i in (0, n // 2, n - 1):
+                if n:
+                    off = 16 + (start + i) * 8
+                    self.assertEqual(int.from_bytes(buf[off:off+8], "little"), ids[i])
+            p = page_from_data(memoryview(buf))
+            self.assertEqual(p.free_ids(), ids)
@@ -4,13 +4,6 @@ import tempfile
 import threading
 
 from boltdb import BoltDB
-from boltdb.rwlock import RWLock
-
-
-class BRWLock(RWLock):
-    def w_acquire(self):
-        if not self.w_lock.acquire(timeout=0.01):
-            raise Exception("blocked")
 
 
 class BLock:
@@ -34,17 +27,41 @@ class TestRW(unittest.TestCase):
         os.unlink(self.db.filename)
 
     def test_rw(self):
-        # replace mmap_lock
-        self.db.mmap_lock = BRWLock()
         wtx = self.db.begin(True)
         rtx = self.db.begin(False)
         wtx.bucket().put(b"foo", b"bar")
         self.assertIsNone(rtx.bucket().get(b"foo"))
-        # writer will block on mmap
-        with self.assertRaisesRegex(Exception, "blocked"):
-            wtx.commit()
-        wtx.close()
+        # writer grows the file without waiting for the reader
+        wtx.commit()
+        old = rtx.mapping
+        self.assertIsNot(old, self.db.mapping)
+        self.assertIsNone(rtx.bucket().get(b"foo"))
         rtx.close()
+        self.assertEqual(old.refs, 0)
+
+        with self.db.view() as tx:
+            self.assertEqual(tx.bucket().get(b"bar"), None)
+            self.assertEqual(tx.bucket().get(b"foo"), b"bar")
+
+    def test_long_reader(self):
+        rtx = self.db.begin(False)
+        done = threading.Event()
+
+        def write():
+            for i in range(200):
+                with self.db.update() as tx:
+                    tx.bucket().put(str(i).encode(), b"*" * 4000)
+            done.set()
+
+        t = threading.Thread(target=write)
+        t.start()
+        self.assertTrue(done.wait(10))
+        t.join()
+        self.assertIsNone(rtx.bucket().get(b"0"))
+        rtx.close()
+
+        with self.db.view() as tx:
+            self.assertEqual(tx.bucket().get(b"0"), b"*" * 4000)
 
     def test_ww(self):
         self.db.lock = BLock()
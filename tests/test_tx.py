@@ -0,0 +1,115 @@
+import os
+import threading
+import unittest
+import tempfile
+
+from boltdb import BoltDB
+from boltdb.db import SYNC_NONE, SYNC_DEFERRED
+from boltdb.page import page_runs
+
+
+class TestTx(unittest.TestCase):
+
+    def setUp(self):
+        self.db = BoltDB(tempfile.mktemp())
+
+    def tearDown(self):
+        os.unlink(self.db.filename)
+
+    def test_page_runs(self):
+        self.assertEqual(page_runs([]), [])
+        self.assertEqual(page_runs([7, 3, 4, 5, 9, 8]), [(3, 3), (7, 3)])
+
+    def test_commit_flushes_dirty_pages(self):
+        with self.db.update() as tx:
+            b = tx.create_bucket(b"widgets")
+            for i in range(10000):
+                k = str(i).encode()
+                b.put(k, k)
+
+        flushed = []
+        flush_range = self.db.flush_range
+
+        def record(offset, size):
+            flushed.append((offset, size))
+            flush_range(offset, size)
+
+        self.db.flush_range = record
+        with self.db.update() as tx:
+            tx.bucket(b"widgets").put(b"foo", b"bar")
+
+        pagesize = self.db.pagesize
+        # meta page is flushed last and on its own
+        meta_pgid = self.db.meta().txid % 2
+        self.assertEqual(flushed[-1], (meta_pgid*pagesize, pagesize))
+        self.assertLess(sum(size for _, size in flushed), self.db.datasz // 4)
+
+
+class TestSync(unittest.TestCase):
+
+    def open(self, **kwargs):
+        db = BoltDB(tempfile.mktemp(), **kwargs)
+        self.addCleanup(os.unlink, db.filename)
+        self.addCleanup(db.close)
+        flushed = []
+        flush_range = db.flush_range
+
+        def record(offset, size):
+            flushed.append((offset, size))
+            flush_range(offset, size)
+
+        db.flush_range = record
+        return db, flushed
+
+    def put(self, db, key):
+        with db.update() as tx:
+            tx.bucket().put(key, key)
+
+    def test_no_sync(self):
+        db, flushed = self.open(sync=SYNC_NONE)
+        self.put(db, b"foo")
+        self.assertEqual(flushed, [])
+        db.sync()
+        self.assertGreater(len(flushed), 0)
+        meta_pgid = db.meta().txid % 2
+        self.assertEqual(flushed[-1], (meta_pgid*db.pagesize, db.pagesize))
+
+    def test_sync_commits(self):
+        db, flushed = self.open(sync=SYNC_DEFERRED, sync_commits=2)
+        self.put(db, b"foo")
+        self.assertEqual(flushed, [])
+        self.put(db, b"bar")
+        self.assertGreater(len(flushed), 0)
+        self.assertEqual(db.unsynced, set())
+
+    def test_sync_interval(self):
+        db, flushed = self.open(sync=SYNC_DEFERRED, sync_interval=0.01)
+        self.put(db, b"foo")
+        db.sync_stop.wait(0.2)
+        self.assertGreater(len(flushed), 0)
+
+    def test_sync_waits_for_writer(self):
+        db, flushed = self.open(sync=SYNC_NONE)
+        self.put(db, b"foo")
+        writer = threading.Thread(target=self.put, args=(db, b"bar"))
+        blocked = []
+        flush_range = db.flush_range
+
+        def commit_during_flush(offset, size):
+            if not blocked:
+                # a commit now would write its meta before ours is flushed
+                writer.start()
+                writer.join(0.1)
+                blocked.append(writer.is_alive())
+            flush_range(offset, size)
+
+        db.flush_range = commit_during_flush
+        db.sync()
+        writer.join()
+        self.assertEqual(blocked, [True])
+        # the later commit waits for the next sync
+        self.assertIn(db.meta().txid % 2, db.unsynced)
+
+    def test_invalid_mode(self):
+        with self.assertRaisesRegex(Exception, "invalid sync mode"):
+            BoltDB(tempfile.mktemp(), sync="sometimes")